@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 
 class ChatRequest(BaseModel):
@@ -9,6 +9,10 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     session_id: str
+    # Tokens of history left out of the upstream request by context windowing
+    context_tokens_saved: int = 0
+    # True when the answer was served from the response cache
+    cached: bool = False
 
 class SessionCreateRequest(BaseModel):
     user_id: Optional[str] = None
@@ -21,6 +25,11 @@ class SessionResponse(BaseModel):
     created_at: datetime
     updated_at: Optional[datetime] = None
     history: Optional[List[dict]] = None
+    # Index of the first returned turn when the history is paginated
+    history_offset: int = 0
+    message_count: int = 0
+    # Cumulative provider tokens: prompt_tokens, completion_tokens and cached_tokens (prompt cache hits)
+    usage: Optional[Dict[str, int]] = None
 
 class SessionListItem(BaseModel):
     """Lightweight session info for listing (without full history)."""
@@ -30,6 +39,18 @@ class SessionListItem(BaseModel):
     created_at: datetime
     updated_at: Optional[datetime] = None
     message_count: int = 0
+    usage: Optional[Dict[str, int]] = None
+
+class SessionSearchResult(BaseModel):
+    """A session matching a search, most relevant first."""
+    session_id: str
+    title: Optional[str] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    message_count: int = 0
+    score: float
+    # Text around the first match in the conversation; None when only the title matched
+    snippet: Optional[str] = None
 
 class DeleteResponse(BaseModel):
     success: bool
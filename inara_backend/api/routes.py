@@ -1,12 +1,40 @@
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Body
-from typing import Optional, List
+import asyncio
+import json
+import hashlib
+import math
+import re
+from contextlib import aclosing
+import anyio
+import orjson
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Body, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+from typing import Optional, List, Literal
 from services.llm_service import LLMService
 from services.session_service import SessionService
-from api.models import ChatResponse, SessionCreateRequest, SessionResponse, SessionListItem, DeleteResponse
+from services.search_service import SessionSearch
+from services.admission import AdmissionController, AdmissionRejected
+from services.idempotency import IDEMPOTENCY_KEY_MAX_LENGTH, IdempotencyConflict, IdempotentRequests, fingerprint
+from services.title_service import TitleWorker
+from services.image_service import ImageProcessor, InvalidImage, UploadTooLarge, read_upload
+from services.upstream import UpstreamUnavailable
+from services.metrics import CLIENT_DISCONNECTS, IMAGE_SIZE, stage
+from api.models import (
+    ChatResponse, SessionCreateRequest, SessionResponse, SessionListItem, SessionSearchResult, DeleteResponse
+)
 
 router = APIRouter()
-llm_service = LLMService()
-session_service = SessionService()
+# Their MongoDB and OpenAI clients are created in the app's lifespan (see main.py)
+session_service = SessionService(connect=False)
+llm_service = LLMService(blob_store=session_service.blobs, connect=False)
+title_worker = TitleWorker(llm_service, session_service)
+session_search = SessionSearch(session_service)
+image_processor = ImageProcessor()
+idempotent_requests = IdempotentRequests()
+admission = AdmissionController()
+
+# How often a request waiting on the LLM checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
 
 @router.post("/sessions", response_model=SessionResponse)
 async def create_session(request: SessionCreateRequest = Body(...)):
@@ -24,33 +52,178 @@ async def create_session(request: SessionCreateRequest = Body(...)):
     )
 
 @router.get("/sessions/{session_id}", response_model=SessionResponse)
-async def get_session(session_id: str):
-    """Gets details and history of a specific session."""
-    session = await session_service.get_session(session_id)
+async def get_session(
+    session_id: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    images: Literal["inline", "placeholder"] = Query("inline")
+):
+    """
+    Gets details and history of a specific session.
+    Without 'limit' the whole history is returned. With it, the latest 'limit' turns are returned
+    and, when older turns exist, the X-Next-Cursor response header holds the 'cursor' for the
+    previous page; 'history_offset' is the index of the first returned turn.
+    images=placeholder replaces image bytes with 'image_placeholder' parts pointing at /images/{sha256}.
+    Responses carry an ETag derived from the session's updated_at; a matching If-None-Match gets a 304.
+    """
+    session = await session_service.get_session_meta(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    return SessionResponse(
-        session_id=session["session_id"],
-        user_id=session.get("user_id"),
-        title=session.get("title"),
-        created_at=session.get("created_at"),
-        updated_at=session.get("updated_at"),
-        history=session.get("history", [])
-    )
+
+    total = session.get("message_count", 0)
+    end = total
+    if cursor is not None:
+        if not cursor.isdigit() or int(cursor) > total:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+        end = int(cursor)
+    start = max(end - limit, 0) if limit else 0
+
+    # Checked before any history is loaded: unchanged sessions cost one small lookup
+    etag = _session_etag(session, start, end if limit or cursor is not None else None, images)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if limit and start > 0:
+        headers["X-Next-Cursor"] = str(start)
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if limit or cursor is not None:
+        history = await session_service.get_history_page(session_id, start, end - start)
+    else:
+        history = await session_service.get_history_page(session_id)
+
+    with stage("serialize.session"):
+        if images == "placeholder":
+            history = _image_placeholders(
+                history, lambda digest: request.app.url_path_for("get_image", sha256=digest)
+            )
+        else:
+            # Clients expect inline image data, so hydrate blob references for this view
+            history = await session_service.blobs.inline_images(history)
+        body = orjson.dumps({
+            "session_id": session["session_id"],
+            "user_id": session.get("user_id"),
+            "title": session.get("title"),
+            "created_at": session.get("created_at"),
+            "updated_at": session.get("updated_at"),
+            "history": history,
+            "history_offset": start,
+            "message_count": total,
+            "usage": session.get("usage")
+        })
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _session_etag(session: dict, start: int, end: Optional[int], images: str) -> str:
+    """Weak ETag for a view of a session; every write to a session bumps its updated_at."""
+    updated_at = session.get("updated_at") or session.get("created_at")
+    raw = f"{updated_at.isoformat()}|{session.get('message_count', 0)}|{start}|{end}|{images}"
+    return f'W/"{hashlib.sha256(raw.encode()).hexdigest()[:32]}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    strip = lambda tag: tag.strip().removeprefix("W/")
+    return any(strip(tag) == strip(etag) for tag in if_none_match.split(","))
+
+def _image_placeholders(history: list, image_url) -> list:
+    """Replaces image parts with metadata and a URL to fetch them from, leaving text untouched."""
+    result = []
+    for turn in history:
+        parts = []
+        for part in turn.get("parts", []):
+            if "image_ref" in part:
+                ref = part["image_ref"]
+                part = {"image_placeholder": {
+                    "mime_type": ref["mime_type"],
+                    "size": ref.get("size"),
+                    "url": image_url(ref["sha256"])
+                }}
+            elif "inline_data" in part:
+                # Legacy inline image: not separately addressable
+                data = part["inline_data"].get("data") or ""
+                part = {"image_placeholder": {
+                    "mime_type": part["inline_data"].get("mime_type"),
+                    "size": len(data) * 3 // 4,
+                    "url": None
+                }}
+            parts.append(part)
+        result.append({**turn, "parts": parts})
+    return result
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+@router.get("/images/{sha256}")
+async def get_image(sha256: str, request: Request):
+    """
+    Serves a stored image by its SHA-256 digest. Content-addressed, so it is cached as immutable.
+    Supports single byte ranges (Range: bytes=start-end).
+    """
+    etag = f'"{sha256}"'
+    cache_headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes"
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    blob = await session_service.blobs.get_blob(sha256)
+    if blob is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    data = blob["data"]
+
+    range_header = request.headers.get("range")
+    match = _RANGE.match(range_header.strip()) if range_header else None
+    if range_header and match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), len(data) - 1) if last else len(data) - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(len(data) - int(last), 0), len(data) - 1
+        if start >= len(data) or start > end:
+            return Response(status_code=416, headers={**cache_headers, "Content-Range": f"bytes */{len(data)}"})
+        return Response(
+            content=data[start:end + 1],
+            status_code=206,
+            media_type=blob["mime_type"],
+            headers={**cache_headers, "Content-Range": f"bytes {start}-{end}/{len(data)}"}
+        )
+    # Unparseable or multi-range requests get the whole image
+    return Response(content=data, media_type=blob["mime_type"], headers=cache_headers)
 
 @router.delete("/sessions/{session_id}", response_model=DeleteResponse)
 async def delete_session(session_id: str):
     """Deletes a session by its ID."""
     deleted = await session_service.delete_session(session_id)
+    llm_service.history_cache.invalidate(session_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Session not found")
     return DeleteResponse(success=True, message="Session deleted successfully")
 
 @router.get("/users/{user_id}/sessions", response_model=List[SessionListItem])
-async def get_user_sessions(user_id: str):
-    """Lists all sessions for a specific user (without full history for performance)."""
-    sessions = await session_service.get_user_sessions(user_id)
+async def get_user_sessions(
+    user_id: str,
+    response: Response,
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = Query(None)
+):
+    """
+    Lists sessions for a specific user (without full history for performance).
+    Paginated by keyset: when more sessions exist, the X-Next-Cursor response header
+    holds the value to pass as 'cursor' for the next page.
+    """
+    try:
+        sessions, next_cursor = await session_service.get_user_sessions(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
     return [
         SessionListItem(
             session_id=s["session_id"],
@@ -58,55 +231,352 @@ async def get_user_sessions(user_id: str):
             title=s.get("title", "New Chat"),
             created_at=s.get("created_at"),
             updated_at=s.get("updated_at"),
-            message_count=len(s.get("history", []))
+            message_count=s.get("message_count", 0),
+            usage=s.get("usage")
         ) for s in sessions
     ]
 
+@router.get("/users/{user_id}/search", response_model=List[SessionSearchResult])
+async def search_user_sessions(
+    user_id: str,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=50),
+    cursor: Optional[str] = Query(None)
+):
+    """
+    Full-text search over a user's session titles and messages, most relevant first.
+    Paginated like the session listing: the X-Next-Cursor response header holds the
+    'cursor' for the next page.
+    """
+    if cursor is not None and not cursor.isdigit():
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    offset = int(cursor) if cursor else 0
+
+    results, has_more = await session_search.search(user_id, q, limit, offset)
+    if has_more:
+        response.headers["X-Next-Cursor"] = str(offset + limit)
+    return [SessionSearchResult(**result) for result in results]
+
+async def _read_image(file: Optional[UploadFile]):
+    """
+    Returns (image_data, mime_type) for an image upload, or (None, None).
+    The upload is read with a size cap and preprocessed (downscaled, re-encoded, metadata
+    stripped); the result is what gets both sent upstream and stored.
+    """
+    if not (file and file.content_type and file.content_type.startswith("image/")):
+        return None, None
+    try:
+        raw = await read_upload(file)
+        IMAGE_SIZE.labels("upload").observe(len(raw))
+        with stage("image.preprocess"):
+            image_data, mime_type = await image_processor.process(raw)
+        IMAGE_SIZE.labels("processed").observe(len(image_data))
+        return image_data, mime_type
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _load_context(session_id: Optional[str]):
+    """
+    Returns (session_id, history, summary, history_offset, history_tokens).
+    New sessions get an id locally and are created by the first append.
+    """
+    if not session_id:
+        return session_service.new_session_id(), [], None, 0, 0
+    history, summary, history_offset, history_tokens = await session_service.get_context(session_id)
+    return session_id, history, summary, history_offset, history_tokens
+
+async def _save_exchange(session_id: str, user_id: Optional[str], message: str, response_text: str,
+                         image_data: bytes = None, mime_type: str = None, summary: dict = None,
+                         usage: dict = None, truncated: bool = False):
+    """Persists a user/model exchange and its token usage, and queues title generation after the first one."""
+    session = await session_service.append_exchange(
+        session_id, user_id, message, response_text, image_data, mime_type, summary, usage, truncated
+    )
+
+    # Generate title after first exchange (user + model response), off the request path
+    if session_service.needs_title(session):
+        if not title_worker.submit(session_id, message, response_text):
+            # Queue is full: settle for the cheap fallback title rather than blocking
+            await session_service.update_session_title(session_id, llm_service.fallback_title(message))
+
+def _upstream_unavailable(e: UpstreamUnavailable) -> HTTPException:
+    """503 for an unhealthy or saturated LLM provider, with Retry-After when known."""
+    headers = {"Retry-After": str(max(1, round(e.retry_after)))} if e.retry_after else None
+    return HTTPException(status_code=503, detail=str(e), headers=headers)
+
+def _admission_rejected(e: AdmissionRejected) -> HTTPException:
+    """429 for a request over its user's rate or finding the queue full, with Retry-After."""
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+async def _admit(request: Request, user_id: Optional[str]) -> str:
+    """
+    Rate-limits and checks queue room for a chat request, raising 429 otherwise.
+    Returns the key it is accounted under: the user, or the client address for anonymous requests.
+    """
+    key = user_id or f"ip:{request.client.host if request.client else 'unknown'}"
+    try:
+        await admission.check(key)
+    except AdmissionRejected as e:
+        raise _admission_rejected(e)
+    return key
+
+def _check_upstream():
+    """Fails fast, before any work is done, while the LLM circuit is open."""
+    try:
+        llm_service.upstream.ensure_available()
+    except UpstreamUnavailable as e:
+        raise _upstream_unavailable(e)
+
+async def _unless_disconnected(request: Request, awaitable):
+    """
+    Awaits 'awaitable', polling the client connection meanwhile. If the client goes away first,
+    the awaitable is cancelled (aborting the upstream call) and ClientDisconnect is raised.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnect()
+    finally:
+        if not task.done():
+            task.cancel()
+            # Let the cancellation unwind (closing the upstream call) before the caller moves on
+            with anyio.CancelScope(shield=True):
+                await asyncio.wait({task})
+
+async def _until_disconnected(request: Request, iterator):
+    """Yields from an async iterator until it ends or the client goes away (raising ClientDisconnect)."""
+    while True:
+        try:
+            yield await _unless_disconnected(request, iterator.__anext__())
+        except StopAsyncIteration:
+            return
+
+def _sse_event(event: str, data: dict) -> str:
+    """Formats a single Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _chat(message: str, session_id: Optional[str], user_id: Optional[str],
+                image_data: Optional[bytes], mime_type: Optional[str], no_cache: bool,
+                admission_key: str, request: Optional[Request] = None) -> dict:
+    """
+    Generates the answer to a message and persists the exchange. Returns the ChatResponse fields.
+    The LLM work waits for a generation slot, shared fairly between admission keys.
+    If 'request' is given and its client disconnects while the answer is generated, the LLM call
+    is cancelled, the question is stored with an empty answer marked 'truncated' and ClientDisconnect is raised.
+    """
+    # Get history (a new session is created together with its first exchange)
+    session_id, history, summary, history_offset, history_tokens = await _load_context(session_id)
+
+    disconnected = False
+    async with admission.slot(admission_key):
+        # Generate response using the windowed history and rolling summary
+        prompt = await llm_service.build_prompt(
+            message, history, image_data, mime_type, summary, session_id,
+            use_cache=not no_cache, history_offset=history_offset, history_tokens=history_tokens
+        )
+        if request is None:
+            response_text = await llm_service.complete(prompt)
+        else:
+            try:
+                response_text = await _unless_disconnected(request, llm_service.complete(prompt))
+            except ClientDisconnect:
+                CLIENT_DISCONNECTS.labels("chat").inc()
+                disconnected = True
+
+    if disconnected:
+        # A non-streamed answer has no partial text to keep
+        await _save_exchange(
+            session_id, user_id, message, "", image_data, mime_type, prompt.summary, prompt.usage, truncated=True
+        )
+        raise ClientDisconnect()
+
+    # Update history with new turn
+    await _save_exchange(
+        session_id, user_id, message, response_text, image_data, mime_type, prompt.summary, prompt.usage
+    )
+
+    return {
+        "response": response_text,
+        "session_id": session_id,
+        "context_tokens_saved": prompt.tokens_saved,
+        "cached": prompt.cache_hit
+    }
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(
+    request: Request,
+    response: Response,
     message: str = Form(...),
     session_id: Optional[str] = Form(None),
     user_id: Optional[str] = Form(None),
-    file: Optional[UploadFile] = File(None)
+    file: Optional[UploadFile] = File(None),
+    no_cache: bool = Form(False),
+    idempotency_key: Optional[str] = Form(None),
+    idempotency_key_header: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     Endpoint to chat with the AI.
     Accepts 'message', optional 'session_id', optional 'user_id', and an optional 'file'.
+    First-turn text-only questions may be answered from the response cache unless 'no_cache' is set.
     If session_id is not provided but user_id is, creates a new session linked to the user.
     Persistence: Stores conversation (including images) in underlying MongoDB.
+
+    Retries should send the same Idempotency-Key (header or form field): a duplicate waits for the
+    original request instead of calling the LLM again, and a completed one is replayed (marked with
+    'Idempotent-Replayed: true') for IDEMPOTENCY_TTL seconds. Either way the exchange is stored once.
+    Reusing a key for a different message answers 422.
+
+    Without a key, a client that disconnects before the answer is ready cancels the LLM call
+    (the question is kept in the history). With one, the answer is still produced for the retry.
+
+    Requests over the user's rate limit, or arriving while the generation queue is full, get 429
+    with Retry-After. Replays are not rate-limited.
     """
+    key = idempotency_key_header or idempotency_key
+    if key is not None and not 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters")
     try:
-        # Create new session if not provided
-        if not session_id:
-            session_id = await session_service.create_session(user_id=user_id)
-        
-        # Get history
-        history = await session_service.get_history(session_id)
-
-        image_data = None
-        mime_type = None
-
-        if file:
-            if file.content_type and file.content_type.startswith("image/"):
-                image_data = await file.read()
-                mime_type = file.content_type
-
-        # Generate response using history
-        response_text = await llm_service.generate_response(message, history, image_data, mime_type)
-        
-        # Update history with new turn
-        # Store USER message with image (if any)
-        await session_service.add_message(session_id, "user", message, image_data, mime_type)
-        
-        # Store MODEL response
-        await session_service.add_message(session_id, "model", response_text)
-        
-        # Generate title after first exchange (user + model response)
-        if await session_service.should_generate_title(session_id):
-            title = await llm_service.generate_title(message, response_text)
-            await session_service.update_session_title(session_id, title)
-
-        return ChatResponse(response=response_text, session_id=session_id)
+        if key is None:
+            _check_upstream()
+            admission_key = await _admit(request, user_id)
+            image_data, mime_type = await _read_image(file)
+            result = await _chat(
+                message, session_id, user_id, image_data, mime_type, no_cache, admission_key, request
+            )
+        else:
+            image_data, mime_type = await _read_image(file)
+
+            async def execute():
+                # Only a request that actually runs is admitted: a retry of a completed or in-flight
+                # one gets its answer even while the user is over their rate or the circuit is open
+                _check_upstream()
+                admission_key = await _admit(request, user_id)
+                return await _chat(message, session_id, user_id, image_data, mime_type, no_cache, admission_key)
 
+            # Keys are scoped per user, and the request they were first used for is remembered
+            result, replayed = await idempotent_requests.run(
+                fingerprint(user_id, key),
+                fingerprint(session_id, message, image_data or b""),
+                execute
+            )
+            if replayed:
+                response.headers["Idempotent-Replayed"] = "true"
+
+        return ChatResponse(**result)
+
+    except HTTPException:
+        raise
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except AdmissionRejected as e:
+        raise _admission_rejected(e)
+    except ClientDisconnect:
+        # Nobody receives this; the status shows up in access logs and metrics
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    except UpstreamUnavailable as e:
+        raise _upstream_unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(
+    request: Request,
+    message: str = Form(...),
+    session_id: Optional[str] = Form(None),
+    user_id: Optional[str] = Form(None),
+    file: Optional[UploadFile] = File(None),
+    no_cache: bool = Form(False)
+):
+    """
+    Streaming variant of /chat using Server-Sent Events.
+    Emits a 'session' event with the session_id, a 'delta' event per generated text chunk,
+    then 'done' (or 'error'). The exchange is persisted once the stream finishes or is aborted.
+    If the client disconnects, generation stops and the partial answer is stored marked 'truncated'.
+    Rate-limited requests get 429 before the stream starts; a queue timeout is an 'error' event
+    with status 429 and 'retry_after'.
+    """
+    _check_upstream()
+    admission_key = await _admit(request, user_id)
+    try:
+        session_id, history, summary, history_offset, history_tokens = await _load_context(session_id)
+
+        # Read the upload now: it is closed once the response starts streaming
+        image_data, mime_type = await _read_image(file)
+
+        prompt = await llm_service.build_prompt(
+            message, history, image_data, mime_type, summary, session_id,
+            use_cache=not no_cache, history_offset=history_offset, history_tokens=history_tokens
+        )
+    except HTTPException:
+        raise
+    except UpstreamUnavailable as e:
+        raise _upstream_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        chunks = []
+        completed = rejected = False
+        try:
+            yield _sse_event("session", {"session_id": session_id})
+            async with admission.slot(admission_key):
+                deltas = llm_service.stream(prompt)
+                async with aclosing(deltas):
+                    async for delta in _until_disconnected(request, deltas):
+                        chunks.append(delta)
+                        yield _sse_event("delta", {"text": delta})
+            completed = True
+            yield _sse_event("done", {
+                "session_id": session_id,
+                "context_tokens_saved": prompt.tokens_saved,
+                "cached": prompt.cache_hit
+            })
+        except ClientDisconnect:
+            # Noticed while waiting for the LLM
+            CLIENT_DISCONNECTS.labels("chat_stream").inc()
+        except (asyncio.CancelledError, GeneratorExit):
+            # Noticed by the server while sending: the stream is cancelled or closed
+            if not completed:
+                CLIENT_DISCONNECTS.labels("chat_stream").inc()
+            raise
+        except AdmissionRejected as e:
+            # Nothing was generated; the client retries the whole message
+            rejected = True
+            yield _sse_event("error", {"status": 429, "detail": str(e), "retry_after": math.ceil(e.retry_after)})
+        except UpstreamUnavailable as e:
+            yield _sse_event("error", {"status": 503, "detail": str(e)})
+        except Exception as e:
+            yield _sse_event("error", {"status": 500, "detail": f"Error generating response: {str(e)}"})
+        finally:
+            # Shield persistence from the cancellation raised when the client disconnects
+            if not rejected:
+                with anyio.CancelScope(shield=True):
+                    await _save_exchange(
+                        session_id, user_id, message, "".join(chunks), image_data, mime_type, prompt.summary,
+                        prompt.usage, truncated=not completed
+                    )
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/stats")
+async def get_stats():
+    """In-process counters for caches and background workers of this worker."""
+    return {
+        "history_cache": llm_service.history_cache.stats(),
+        "response_cache": llm_service.response_cache.stats(),
+        "idempotency": idempotent_requests.stats(),
+        "admission": admission.stats(),
+        "upstream": llm_service.upstream.stats(),
+        "title_queue": {"pending": title_worker.queue.qsize()}
+    }
@@ -0,0 +1,51 @@
+"""
+Moves the history of idle sessions out of the hot collections into 'session_archive'.
+
+    python archive_sessions.py                      # sessions idle for SESSION_ARCHIVE_AFTER_DAYS (90)
+    python archive_sessions.py --idle-days 30 --limit 10000
+    python archive_sessions.py --dry-run            # report what would be reclaimed, write nothing
+
+Each archived session keeps its document with the metadata listings need (title, dates,
+message_count, usage, summary) and 'archived_at'; its turns are stored as compressed BSON
+(zstd if the 'zstandard' package is installed, zlib otherwise). Reading an archived session
+decompresses it on the fly, and the next message sent to it moves its history back.
+Search still finds archived conversations by their text: the text of their turns stays in the
+small 'turn_text' collection (no images), which the archive does not touch.
+
+Safe to run while serving (e.g. nightly from cron), but run one instance at a time.
+"""
+import argparse
+import asyncio
+import sys
+from services.session_service import SESSION_ARCHIVE_AFTER_DAYS, SessionService
+
+
+def _size(count: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024 or unit == "GB":
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+
+
+async def main(args) -> int:
+    service = SessionService()
+    report = await service.archive_idle_sessions(
+        idle_days=args.idle_days, batch_size=args.batch_size, limit=args.limit, dry_run=args.dry_run
+    )
+    verb = "Would archive" if args.dry_run else "Archived"
+    print(f"{verb} {report['sessions']} sessions ({report['turns']} turns), skipped {report['skipped']}")
+    ratio = report["hot_bytes"] / report["archive_bytes"] if report["archive_bytes"] else 0
+    print(f"Removed from hot collections: {_size(report['hot_bytes'])}")
+    print(f"Stored in archive:            {_size(report['archive_bytes'])} ({ratio:.1f}x smaller)")
+    print(f"Reclaimed:                    {_size(report['reclaimed_bytes'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive the history of idle sessions")
+    parser.add_argument("--idle-days", type=float, default=SESSION_ARCHIVE_AFTER_DAYS,
+                        help="archive sessions not updated for this many days")
+    parser.add_argument("--limit", type=int, help="archive at most this many sessions")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be archived")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,117 @@
+"""
+Cold-start benchmark: launches the production server (serve.py) repeatedly and times how long
+each start takes to serve, then how long it takes to drain and exit on SIGTERM.
+
+    python -m bench.coldstart --runs 5 --workers 2
+    python -m bench.coldstart --app main:app --runs 5      # against the real MongoDB in MONGO_URI
+
+Per run it reports, from process launch:
+  ready        first successful GET / (interpreter start, imports, lifespan: Mongo ping,
+               indexes, LLM and image pool warm-up)
+  first_chat   latency of the first POST /api/chat, right after ready
+  warm_chat    latency of the second one, for comparison
+  shutdown     SIGTERM until the process has exited
+
+By default the app runs on the in-memory Mongo stand-in (bench.server:app) against the fake
+OpenAI server; the fake's latency is set to 0 so chat timings show only the server's own cost.
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.run import BACKEND_DIR, start, wait_for
+
+PHASES = ("ready", "first_chat", "warm_chat", "shutdown")
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode} before it was ready")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def timed_chat(base_url: str) -> float:
+    started = time.perf_counter()
+    response = httpx.post(f"{base_url}/api/chat", data={"message": "What is the usual adult dose of amoxicillin?"},
+                          timeout=30.0)
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+def measure(args, env) -> dict:
+    base_url = f"http://127.0.0.1:{args.port}"
+    launched = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--app", args.app, "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env
+    )
+    try:
+        wait_until_ready(f"{base_url}/", server, args.timeout)
+        timings = {"ready": time.perf_counter() - launched}
+        timings["first_chat"] = timed_chat(base_url)
+        timings["warm_chat"] = timed_chat(base_url)
+        stopping = time.perf_counter()
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=args.timeout)
+        timings["shutdown"] = time.perf_counter() - stopping
+        return timings
+    finally:
+        if server.poll() is None:
+            server.kill()
+            server.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure server cold-start and shutdown time")
+    parser.add_argument("--app", default="bench.server:app", help="import string passed to serve.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--openai-port", type=int, default=9100)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds allowed for startup and for shutdown")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "bench"),
+        "RESPONSE_CACHE_ENABLED": "false",
+    })
+    fake = start("bench.fake_openai", [
+        "--port", str(args.openai_port), "--latency", "0", "--jitter", "0", "--tokens-per-second", "0"
+    ], env)
+    try:
+        wait_for(f"http://127.0.0.1:{args.openai_port}/stats")
+        results = []
+        for run in range(1, args.runs + 1):
+            timings = measure(args, env)
+            results.append(timings)
+            print(f"run {run}: " + "  ".join(f"{phase} {timings[phase] * 1000:.0f}ms" for phase in PHASES))
+    finally:
+        fake.terminate()
+        fake.wait(timeout=15)
+
+    print(f"{'':12}{'median':>10}{'max':>10}")
+    for phase in PHASES:
+        values = [timings[phase] * 1000 for timings in results]
+        print(f"{phase:12}{statistics.median(values):>8.0f}ms{max(values):>8.0f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Local stand-in for the OpenAI chat completions API, for benchmarks.
+
+Answers POST /v1/chat/completions (streaming and non-streaming) after a configurable
+time-to-first-token, then emits tokens at a configurable rate. Point the backend at it with
+OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 and any OPENAI_API_KEY.
+
+    python -m bench.fake_openai --port 9100 --latency 0.3 --tokens-per-second 80
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Seconds before the first token, with uniform jitter of +/- LATENCY_JITTER
+FAKE_LATENCY = float(os.getenv("FAKE_OPENAI_LATENCY", "0.3"))
+FAKE_LATENCY_JITTER = float(os.getenv("FAKE_OPENAI_LATENCY_JITTER", "0.1"))
+# Generation speed after the first token; 0 means instant
+FAKE_TOKENS_PER_SECOND = float(os.getenv("FAKE_OPENAI_TOKENS_PER_SECOND", "80"))
+FAKE_COMPLETION_TOKENS = int(os.getenv("FAKE_OPENAI_COMPLETION_TOKENS", "120"))
+# Fraction of requests answered with a 500, to exercise retries and the circuit breaker
+FAKE_ERROR_RATE = float(os.getenv("FAKE_OPENAI_ERROR_RATE", "0"))
+
+WORDS = (
+    "the of and to in is for that with on as it be are this by from or at an "
+    "prayer hymn verse psalm grace light peace hope faith morning evening song"
+).split()
+
+# Prompt caching as the provider does it: prompts of at least 1024 tokens, cached in 128-token steps
+CACHE_MIN_TOKENS = 1024
+CACHE_STEP_TOKENS = 128
+CACHE_MAX_PREFIXES = 100_000
+
+app = FastAPI(title="Fake OpenAI")
+stats = {"requests": 0, "streams": 0, "errors": 0, "prompt_tokens": 0, "cached_tokens": 0}
+# Hashes of message prefixes seen so far, most recent last
+_prefixes: "OrderedDict[str, None]" = OrderedDict()
+
+
+def _message_tokens(message: Dict) -> int:
+    """Rough message size (chars / 4), images counted at the low-detail rate."""
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return len(content) // 4 + 4
+    return sum(len(part.get("text", "")) // 4 if part.get("type") == "text" else 85 for part in content)
+
+
+def _prompt_tokens(messages: List[Dict]) -> int:
+    return sum(_message_tokens(message) for message in messages)
+
+
+def _cached_tokens(messages: List[Dict]) -> int:
+    """
+    Tokens of the longest message prefix already seen in an earlier request, rounded down to the
+    cache step. Remembers this request's prefixes for the next ones.
+    """
+    digest = hashlib.sha256()
+    tokens = cached = 0
+    for message in messages:
+        digest.update(json.dumps(message, sort_keys=True).encode())
+        tokens += _message_tokens(message)
+        key = digest.hexdigest()
+        if key in _prefixes:
+            _prefixes.move_to_end(key)
+            cached = tokens
+        else:
+            _prefixes[key] = None
+    while len(_prefixes) > CACHE_MAX_PREFIXES:
+        _prefixes.popitem(last=False)
+    return cached // CACHE_STEP_TOKENS * CACHE_STEP_TOKENS if cached >= CACHE_MIN_TOKENS else 0
+
+
+def _completion(body: Dict) -> List[str]:
+    """Completion text as a list of tokens (words with their leading space)."""
+    messages = body.get("messages", [])
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        # Batched title generation numbers its conversations [0], [1], ...
+        prompt = "\n".join(m.get("content") or "" for m in messages if isinstance(m.get("content"), str))
+        count = len(set(re.findall(r"^\[(\d+)\]$", prompt, re.MULTILINE))) or 1
+        titles = [f"Benchmark Title {i}" for i in range(count)]
+        return [json.dumps({"titles": titles})]
+    length = min(FAKE_COMPLETION_TOKENS, body.get("max_completion_tokens") or body.get("max_tokens") or FAKE_COMPLETION_TOKENS)
+    rng = random.Random(len(json.dumps(messages)))
+    return [(" " if i else "") + rng.choice(WORDS) for i in range(length)]
+
+
+def _usage(body: Dict, completion_tokens: int) -> Dict:
+    messages = body.get("messages", [])
+    prompt_tokens, cached_tokens = _prompt_tokens(messages), _cached_tokens(messages)
+    stats["prompt_tokens"] += prompt_tokens
+    stats["cached_tokens"] += cached_tokens
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+async def _first_token_delay():
+    await asyncio.sleep(max(0.0, FAKE_LATENCY + random.uniform(-FAKE_LATENCY_JITTER, FAKE_LATENCY_JITTER)))
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    if FAKE_ERROR_RATE and random.random() < FAKE_ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "injected failure", "type": "server_error"}})
+
+    tokens = _completion(body)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    model = body.get("model", "fake")
+    await _first_token_delay()
+
+    if not body.get("stream"):
+        if FAKE_TOKENS_PER_SECOND:
+            await asyncio.sleep(len(tokens) / FAKE_TOKENS_PER_SECOND)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(body, len(tokens)),
+        }
+
+    stats["streams"] += 1
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    def chunk(delta: Dict, finish_reason=None, usage=None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if usage is None else [],
+        }
+        if usage is not None:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def generate():
+        yield chunk({"role": "assistant", "content": ""})
+        for token in tokens:
+            if FAKE_TOKENS_PER_SECOND:
+                await asyncio.sleep(1 / FAKE_TOKENS_PER_SECOND)
+            yield chunk({"content": token})
+        yield chunk({}, finish_reason="stop")
+        if include_usage:
+            yield chunk({}, usage=_usage(body, len(tokens)))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+@app.get("/v1/models/{model}")
+async def retrieve_model(model: str):
+    return {"id": model, "object": "model", "created": 0, "owned_by": "bench"}
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=FAKE_LATENCY, help="seconds to first token")
+    parser.add_argument("--jitter", type=float, default=FAKE_LATENCY_JITTER)
+    parser.add_argument("--tokens-per-second", type=float, default=FAKE_TOKENS_PER_SECOND)
+    parser.add_argument("--completion-tokens", type=int, default=FAKE_COMPLETION_TOKENS)
+    parser.add_argument("--error-rate", type=float, default=FAKE_ERROR_RATE)
+    args = parser.parse_args()
+
+    FAKE_LATENCY = args.latency
+    FAKE_LATENCY_JITTER = args.jitter
+    FAKE_TOKENS_PER_SECOND = args.tokens_per_second
+    FAKE_COMPLETION_TOKENS = args.completion_tokens
+    FAKE_ERROR_RATE = args.error_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
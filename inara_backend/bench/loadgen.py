@@ -0,0 +1,226 @@
+"""
+Async load generator for the backend.
+
+Each virtual user creates a session, sends a number of chat turns (optionally with an image
+every few turns), lists its sessions and loads the session back. Reports throughput and
+p50/p95/p99 latency per endpoint, and can compare a run against a saved baseline.
+
+    python -m bench.loadgen --base-url http://127.0.0.1:8100 --concurrency 50 --duration 30
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile of pre-sorted samples."""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, math.ceil(q / 100 * len(samples)) - 1))
+    return samples[index]
+
+
+def make_image(width: int = 1600, height: int = 1200) -> bytes:
+    """A noisy JPEG, so uploads exercise preprocessing like a real photo would."""
+    from PIL import Image
+
+    img = Image.effect_noise((width, height), 64).convert("RGB")
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, seconds: float, status: Optional[int]):
+        self.statuses[endpoint][status or 0] += 1
+        if status is None or status >= 400:
+            self.errors[endpoint] += 1
+        else:
+            self.latencies[endpoint].append(seconds)
+
+    def report(self, elapsed: float) -> Dict:
+        endpoints = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            samples = sorted(self.latencies[endpoint])
+            count = len(samples) + self.errors[endpoint]
+            endpoints[endpoint] = {
+                "count": count,
+                "errors": self.errors[endpoint],
+                "statuses": {str(k): v for k, v in sorted(self.statuses[endpoint].items())},
+                "rps": round(count / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": round(percentile(samples, 50) * 1000, 1),
+                "p95_ms": round(percentile(samples, 95) * 1000, 1),
+                "p99_ms": round(percentile(samples, 99) * 1000, 1),
+                "max_ms": round(samples[-1] * 1000, 1) if samples else 0.0,
+            }
+        return {"elapsed_seconds": round(elapsed, 2), "endpoints": endpoints}
+
+
+class LoadGenerator:
+    def __init__(self, base_url: str, concurrency: int, duration: float, turns: int,
+                 image_every: int, stream: bool, think_time: float, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.duration = duration
+        self.turns = turns
+        self.image_every = image_every
+        self.stream = stream
+        self.think_time = think_time
+        self.timeout = timeout
+        self.recorder = Recorder()
+        self.image = make_image() if image_every else None
+
+    async def _request(self, client: httpx.AsyncClient, endpoint: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.recorder.record(endpoint, time.perf_counter() - start, None)
+            return None
+        self.recorder.record(endpoint, time.perf_counter() - start, response.status_code)
+        return response
+
+    async def _stream(self, client: httpx.AsyncClient, data: Dict, files: Optional[Dict]) -> Optional[str]:
+        """Sends a streamed chat turn; records time to first delta and to completion."""
+        start = time.perf_counter()
+        session_id = None
+        first = None
+        status = None
+        try:
+            async with client.stream("POST", "/api/chat/stream", data=data, files=files) as response:
+                status = response.status_code
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        if event == "session":
+                            session_id = json.loads(line[len("data: "):])["session_id"]
+                        elif event == "delta" and first is None:
+                            first = time.perf_counter() - start
+                        elif event == "error":
+                            status = json.loads(line[len("data: "):]).get("status", 500)
+        except httpx.HTTPError:
+            status = None
+        self.recorder.record("POST /api/chat/stream", time.perf_counter() - start, status)
+        if first is not None:
+            self.recorder.record("POST /api/chat/stream (first delta)", first, status)
+        return session_id
+
+    async def _user(self, client: httpx.AsyncClient, deadline: float):
+        while time.monotonic() < deadline:
+            user_id = f"bench-{uuid.uuid4().hex[:12]}"
+            response = await self._request(client, "POST /api/sessions", "POST", "/api/sessions",
+                                           json={"user_id": user_id})
+            if response is None or response.status_code != 200:
+                await asyncio.sleep(0.1)
+                continue
+            session_id = response.json()["session_id"]
+
+            for turn in range(self.turns):
+                if time.monotonic() >= deadline:
+                    return
+                data = {"message": f"Turn {turn}: tell me about hymn {random.randint(1, 500)}",
+                        "session_id": session_id, "user_id": user_id}
+                files = None
+                if self.image is not None and turn % self.image_every == self.image_every - 1:
+                    files = {"file": ("photo.jpg", self.image, "image/jpeg")}
+                if self.stream:
+                    await self._stream(client, data, files)
+                else:
+                    await self._request(client, "POST /api/chat", "POST", "/api/chat", data=data, files=files)
+                if self.think_time:
+                    await asyncio.sleep(random.uniform(0, 2 * self.think_time))
+
+            await self._request(client, "GET /api/users/{id}/sessions", "GET", f"/api/users/{user_id}/sessions")
+            await self._request(client, "GET /api/sessions/{id}", "GET", f"/api/sessions/{session_id}")
+
+    async def run(self) -> Dict:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits) as client:
+            start = time.monotonic()
+            deadline = start + self.duration
+            await asyncio.gather(*(self._user(client, deadline) for _ in range(self.concurrency)))
+            return self.recorder.report(time.monotonic() - start)
+
+
+def print_report(report: Dict, out=sys.stdout):
+    header = f"{'endpoint':<38} {'count':>7} {'errors':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(f"elapsed: {report['elapsed_seconds']}s", file=out)
+    print(header, file=out)
+    print("-" * len(header), file=out)
+    for endpoint, row in report["endpoints"].items():
+        print(f"{endpoint:<38} {row['count']:>7} {row['errors']:>6} {row['rps']:>8} "
+              f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}", file=out)
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions of this run against a baseline report: p95/p99 up or rps down by more than tolerance."""
+    regressions = []
+    for endpoint, old in baseline.get("endpoints", {}).items():
+        new = report["endpoints"].get(endpoint)
+        if new is None:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if old[key] and new[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{endpoint}: {key} {old[key]} -> {new[key]}")
+        if old["rps"] and new["rps"] < old["rps"] * (1 - tolerance):
+            regressions.append(f"{endpoint}: rps {old['rps']} -> {new['rps']}")
+        if new["errors"] > old["errors"]:
+            regressions.append(f"{endpoint}: errors {old['errors']} -> {new['errors']}")
+    return regressions
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--turns", type=int, default=5, help="chat turns per session")
+    parser.add_argument("--image-every", type=int, default=0, help="attach an image every N turns (0: never)")
+    parser.add_argument("--stream", action="store_true", help="use /api/chat/stream instead of /api/chat")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between turns, seconds")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", dest="json_path", help="write the report as JSON to this file")
+    parser.add_argument("--baseline", help="baseline JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+
+
+def run_load(args) -> int:
+    generator = LoadGenerator(args.base_url, args.concurrency, args.duration, args.turns,
+                              args.image_every, args.stream, args.think_time, args.timeout)
+    report = asyncio.run(generator.run())
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for the Inara backend")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8100")
+    add_arguments(parser)
+    sys.exit(run_load(parser.parse_args()))
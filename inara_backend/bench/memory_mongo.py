@@ -0,0 +1,532 @@
+"""
+In-memory stand-in for the subset of the Motor API used by SessionService and BlobStore.
+
+Good enough to exercise the application for benchmarks without a MongoDB server; it does not
+try to model MongoDB performance. Not for production use.
+"""
+import copy
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get_path(doc: Dict, path: str) -> Any:
+    """Resolves a dotted path; traverses into arrays and returns a list of values when it does."""
+    value: Any = doc
+    for i, key in enumerate(path.split(".")):
+        if isinstance(value, list):
+            rest = ".".join(path.split(".")[i:])
+            values = [_get_path(item, rest) for item in value if isinstance(item, dict)]
+            return [v for v in values if v is not _MISSING]
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+    return value
+
+
+def _set_path(doc: Dict, path: str, value: Any):
+    keys = path.split(".")
+    for key in keys[:-1]:
+        doc = doc.setdefault(key, {})
+    doc[keys[-1]] = value
+
+
+def _unset_path(doc: Dict, path: str):
+    keys = path.split(".")
+    for key in keys[:-1]:
+        doc = doc.get(key)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(keys[-1], None)
+
+
+def _compare(op: str, value: Any, operand: Any) -> bool:
+    candidates = value if isinstance(value, list) else [value]
+    for candidate in candidates:
+        if candidate is _MISSING or candidate is None:
+            continue
+        try:
+            if op == "$lt" and candidate < operand:
+                return True
+            if op == "$lte" and candidate <= operand:
+                return True
+            if op == "$gt" and candidate > operand:
+                return True
+            if op == "$gte" and candidate >= operand:
+                return True
+        except TypeError:
+            continue
+    return False
+
+
+def _equals(value: Any, expected: Any) -> bool:
+    if value is _MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _match_condition(value: Any, condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, operand in condition.items():
+            if op in ("$lt", "$lte", "$gt", "$gte"):
+                if not _compare(op, value, operand):
+                    return False
+            elif op == "$in":
+                if not any(_equals(value, item) for item in operand):
+                    return False
+            elif op == "$nin":
+                if any(_equals(value, item) for item in operand):
+                    return False
+            elif op == "$ne":
+                if _equals(value, operand):
+                    return False
+            elif op == "$exists":
+                if (value is not _MISSING) != bool(operand):
+                    return False
+            elif op == "$size":
+                if not isinstance(value, list) or len(value) != operand:
+                    return False
+            else:
+                raise NotImplementedError(f"Query operator {op} is not supported in memory")
+        return True
+    return _equals(value, condition)
+
+
+def matches(doc: Dict, query: Dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key.startswith("$"):
+            raise NotImplementedError(f"Query operator {key} is not supported in memory")
+        elif not _match_condition(_get_path(doc, key), condition):
+            return False
+    return True
+
+
+def _text_values(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [text for item in value for text in _text_values(item)]
+    return []
+
+
+def _text_at(doc: Any, path: List[str]) -> List[str]:
+    """All strings at a dotted path, traversing arrays."""
+    if not path:
+        return _text_values(doc)
+    if isinstance(doc, list):
+        return [text for item in doc for text in _text_at(item, path)]
+    if isinstance(doc, dict) and path[0] in doc:
+        return _text_at(doc[path[0]], path[1:])
+    return []
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\w+", text.casefold())
+
+
+def text_score(doc: Dict, fields: Dict[str, int], search: str) -> float:
+    """
+    Rough stand-in for MongoDB's textScore: weighted count of query terms found in the indexed
+    fields. Terms match on a shared 5-character prefix, a crude substitute for stemming.
+    """
+    terms = [t[:5] for t in _words(" ".join(w for w in search.split() if not w.startswith("-")))]
+    score = 0.0
+    for field, weight in fields.items():
+        for text in _text_at(doc, field.split(".")):
+            words = _words(text)
+            if not words:
+                continue
+            hits = sum(1 for word in words for term in terms if word.startswith(term))
+            score += weight * hits / len(words) * 10
+    return score
+
+
+def _evaluate(doc: Dict, expr: Any) -> Any:
+    """Evaluates the few aggregation expressions used in pipeline updates."""
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get_path(doc, expr[1:])
+        return None if value is _MISSING else value
+    if isinstance(expr, dict) and len(expr) == 1:
+        op, arg = next(iter(expr.items()))
+        if op == "$size":
+            return len(_evaluate(doc, arg))
+        if op == "$ifNull":
+            value = _evaluate(doc, arg[0])
+            return _evaluate(doc, arg[1]) if value is None else value
+    return expr
+
+
+def _apply_update(doc: Dict, update: Any, inserting: bool):
+    if isinstance(update, list):
+        for stage in update:
+            for op, fields in stage.items():
+                if op != "$set":
+                    raise NotImplementedError(f"Pipeline stage {op} is not supported in memory")
+                for path, expr in fields.items():
+                    _set_path(doc, path, _evaluate(doc, expr))
+        return
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set":
+                _set_path(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set_path(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                _unset_path(doc, path)
+            elif op == "$inc":
+                current = _get_path(doc, path)
+                _set_path(doc, path, (0 if current is _MISSING else current) + value)
+            elif op == "$push":
+                current = _get_path(doc, path)
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                if current is _MISSING:
+                    current = []
+                    _set_path(doc, path, current)
+                position = value.get("$position", len(current)) if isinstance(value, dict) else len(current)
+                current[position:position] = copy.deepcopy(items)
+            elif op == "$addToSet":
+                current = _get_path(doc, path)
+                if current is _MISSING:
+                    current = []
+                    _set_path(doc, path, current)
+                if value not in current:
+                    current.append(copy.deepcopy(value))
+            elif op == "$pull":
+                current = _get_path(doc, path)
+                if isinstance(current, list):
+                    current[:] = [item for item in current if item != value]
+            else:
+                raise NotImplementedError(f"Update operator {op} is not supported in memory")
+
+
+def _project(doc: Dict, projection: Optional[Dict]) -> Dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    include_id = projection.get("_id", 1)
+    slices = {k: v["$slice"] for k, v in projection.items() if isinstance(v, dict) and "$slice" in v}
+    fields = {k: v for k, v in projection.items() if k != "_id" and k not in slices}
+    if fields and all(v for v in fields.values()):
+        result = {}
+        for path in list(fields) + list(slices):
+            value = _get_path(doc, path.split(".")[0])
+            if value is not _MISSING:
+                result[path.split(".")[0]] = copy.deepcopy(value)
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+    else:
+        # $slice alone does not switch to inclusion, as in MongoDB
+        result = copy.deepcopy(doc)
+        for path, keep in fields.items():
+            if not keep:
+                _unset_path(result, path)
+        if not include_id:
+            result.pop("_id", None)
+    for path, count in slices.items():
+        value = result.get(path)
+        if isinstance(value, list):
+            if isinstance(count, list):
+                skip, limit = count
+                value = value[skip:] if skip >= 0 else value[max(len(value) + skip, 0):]
+                result[path] = value[:limit]
+            else:
+                result[path] = value[count:] if count < 0 else value[:count]
+    return result
+
+
+def _sorted(docs: List[Dict], sort: List[Tuple[str, int]]) -> List[Dict]:
+    docs = list(docs)
+    for key, direction in reversed(sort):
+        def sort_key(doc, key=key):
+            value = _get_path(doc, key)
+            # Missing values sort first, like MongoDB's null ordering
+            return (value is not _MISSING, value if value is not _MISSING else 0)
+        docs.sort(key=sort_key, reverse=direction < 0)
+    return docs
+
+
+def _sort_spec(key_or_list, direction: int = 1) -> List[Tuple[str, int]]:
+    return [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class MemoryCursor:
+    def __init__(self, docs: List[Dict], projection: Optional[Dict], scores: Dict[int, float] = None):
+        self._docs = docs
+        self._projection = projection
+        # textScore per document (by id), for $text queries
+        self._scores = scores or {}
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction: int = 1) -> "MemoryCursor":
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, count: int) -> "MemoryCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int) -> "MemoryCursor":
+        return self
+
+    def _results(self) -> List[Dict]:
+        plain_sort = [(k, d) for k, d in self._sort if not isinstance(d, dict)]
+        docs = _sorted(self._docs, plain_sort)
+        if len(plain_sort) != len(self._sort):
+            # {"$meta": "textScore"}: highest score first
+            docs.sort(key=lambda doc: self._scores.get(id(doc), 0.0), reverse=True)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        meta = {k: v for k, v in (self._projection or {}).items() if isinstance(v, dict) and "$meta" in v}
+        projection = {k: v for k, v in (self._projection or {}).items() if k not in meta} or None
+        results = []
+        for doc in docs:
+            result = _project(doc, projection)
+            for field in meta:
+                result[field] = self._scores.get(id(doc), 0.0)
+            results.append(result)
+        return results
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict]:
+        results = self._results()
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._results():
+            yield doc
+
+
+class MemoryCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self._docs: List[Dict] = []
+        # Unique indexes as hash maps, also used to answer equality lookups without a scan
+        self._unique: Dict[Tuple[str, ...], Dict[tuple, Dict]] = {("_id",): {}}
+        # Fields of the collection's text index, with their weights
+        self._text_fields: Dict[str, int] = {}
+        # Index name -> key spec, as index_information() reports it
+        self._indexes: Dict[str, List[Tuple[str, Any]]] = {"_id_": [("_id", 1)]}
+
+    @staticmethod
+    def _index_key(doc: Dict, keys: Tuple[str, ...]) -> Optional[tuple]:
+        values = tuple(_get_path(doc, k) for k in keys)
+        if any(v is _MISSING or isinstance(v, (list, dict)) for v in values):
+            return None
+        return values
+
+    def _index(self, doc: Dict):
+        for keys, index in self._unique.items():
+            key = self._index_key(doc, keys)
+            if key is None:
+                continue
+            if key in index and index[key] is not doc:
+                raise DuplicateKeyError(f"E11000 duplicate key in {self.name}: {dict(zip(keys, key))}")
+            index[key] = doc
+
+    def _unindex(self, doc: Dict):
+        for keys, index in self._unique.items():
+            key = self._index_key(doc, keys)
+            if key is not None and index.get(key) is doc:
+                del index[key]
+
+    def _candidates(self, query: Dict) -> List[Dict]:
+        for keys, index in self._unique.items():
+            if all(k in query and not isinstance(query[k], (dict, list)) for k in keys):
+                doc = index.get(tuple(query[k] for k in keys))
+                return [doc] if doc is not None else []
+        return self._docs
+
+    def _matching(self, query: Dict) -> List[Dict]:
+        return [d for d in self._candidates(query) if matches(d, query)]
+
+    async def create_index(self, keys, unique: bool = False, **kwargs) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        fields = tuple(k for k, _ in keys)
+        text_fields = [k for k, v in keys if v == "text"]
+        if text_fields:
+            weights = kwargs.get("weights") or {}
+            self._text_fields = {k: weights.get(k, 1) for k in text_fields}
+        if unique and fields not in self._unique:
+            self._unique[fields] = {}
+            for doc in self._docs:
+                self._index(doc)
+        name = kwargs.get("name") or "_".join(f"{k}_{v}" for k, v in keys)
+        self._indexes[name] = list(keys)
+        return name
+
+    async def index_information(self) -> Dict[str, Dict]:
+        return {name: {"key": keys} for name, keys in self._indexes.items()}
+
+    async def drop_index(self, name: str):
+        keys = self._indexes.pop(name)
+        if any(v == "text" for _, v in keys):
+            self._text_fields = {}
+        self._unique.pop(tuple(k for k, _ in keys), None)
+
+    async def insert_one(self, document: Dict):
+        document.setdefault("_id", ObjectId())
+        stored = copy.deepcopy(document)
+        self._index(stored)
+        self._docs.append(stored)
+        return _Result(inserted_id=document["_id"])
+
+    async def insert_many(self, documents: List[Dict], ordered: bool = True):
+        ids, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                ids.append((await self.insert_one(document)).inserted_id)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(ids)})
+        return _Result(inserted_ids=ids)
+
+    def _first(self, query: Dict, sort=None) -> Optional[Dict]:
+        docs = self._matching(query)
+        if sort:
+            docs = _sorted(docs, _sort_spec(sort))
+        return docs[0] if docs else None
+
+    async def find_one(self, query: Dict = None, projection: Dict = None, sort=None) -> Optional[Dict]:
+        doc = self._first(query or {}, sort)
+        return _project(doc, projection) if doc else None
+
+    def find(self, query: Dict = None, projection: Dict = None) -> MemoryCursor:
+        query = dict(query or {})
+        text = query.pop("$text", None)
+        docs = self._matching(query)
+        if text is None:
+            return MemoryCursor(docs, projection)
+        if not self._text_fields:
+            raise RuntimeError(f"text index required for $text query on {self.name}")
+        scores = {id(doc): text_score(doc, self._text_fields, text["$search"]) for doc in docs}
+        return MemoryCursor([doc for doc in docs if scores[id(doc)] > 0], projection, scores)
+
+    async def count_documents(self, query: Dict) -> int:
+        return len(self._matching(query))
+
+    def _upsert_base(self, query: Dict) -> Dict:
+        return {
+            k: copy.deepcopy(v) for k, v in query.items()
+            if not k.startswith("$") and not (isinstance(v, dict) and any(x.startswith("$") for x in v))
+        }
+
+    async def _update(self, query: Dict, update: Any, upsert: bool, many: bool):
+        docs = self._matching(query)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            # Applied in place: copying whole documents per update would dominate benchmark timings
+            self._unindex(doc)
+            _apply_update(doc, update, inserting=False)
+            self._index(doc)
+        upserted_id = None
+        if not docs and upsert:
+            doc = self._upsert_base(query)
+            _apply_update(doc, update, inserting=True)
+            upserted_id = (await self.insert_one(doc)).inserted_id
+        return docs, upserted_id
+
+    async def update_one(self, query: Dict, update: Any, upsert: bool = False):
+        docs, upserted_id = await self._update(query, update, upsert, many=False)
+        return _Result(matched_count=len(docs), modified_count=len(docs), upserted_id=upserted_id)
+
+    async def update_many(self, query: Dict, update: Any, upsert: bool = False):
+        docs, upserted_id = await self._update(query, update, upsert, many=True)
+        return _Result(matched_count=len(docs), modified_count=len(docs), upserted_id=upserted_id)
+
+    async def find_one_and_update(self, query: Dict, update: Any, projection: Dict = None,
+                                  upsert: bool = False, return_document: bool = ReturnDocument.BEFORE, sort=None):
+        before = self._first(query, sort)
+        before_copy = copy.deepcopy(before) if before else None
+        docs, upserted_id = await self._update(query, update, upsert, many=False)
+        if return_document == ReturnDocument.AFTER:
+            after = docs[0] if docs else self._first({"_id": upserted_id}) if upserted_id else None
+            return _project(after, projection) if after else None
+        return _project(before_copy, projection) if before_copy else None
+
+    async def delete_one(self, query: Dict):
+        docs = self._matching(query)
+        if not docs:
+            return _Result(deleted_count=0)
+        self._unindex(docs[0])
+        self._docs.remove(docs[0])
+        return _Result(deleted_count=1)
+
+    async def delete_many(self, query: Dict):
+        docs = self._matching(query)
+        for doc in docs:
+            self._unindex(doc)
+        removed = set(map(id, docs))
+        self._docs = [d for d in self._docs if id(d) not in removed]
+        return _Result(deleted_count=len(docs))
+
+
+class MemoryDatabase:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    async def command(self, name: str, *args, **kwargs) -> Dict:
+        return {"ok": 1.0}
+
+    def get_collection(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self.get_collection(name)
+
+
+class MemoryMongoClient:
+    """Drop-in for AsyncIOMotorClient(uri, **kwargs); the URI and options are ignored."""
+
+    def __init__(self, *args, **kwargs):
+        self._databases: Dict[str, MemoryDatabase] = {}
+        self.admin = self.get_database("admin")
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name)
+        return self._databases[name]
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        return self.get_database(name)
+
+    def close(self):
+        pass
@@ -0,0 +1,88 @@
+"""
+One-shot benchmark: starts the fake OpenAI server and the backend (in-memory Mongo) as
+subprocesses, drives load against them and prints the per-endpoint report.
+
+    python -m bench.run --concurrency 50 --duration 30 --json bench-results.json
+    python -m bench.run --baseline bench-results.json   # exits 1 on regression
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.loadgen import add_arguments, run_load
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start(module: str, args, env) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", module, *args], cwd=BACKEND_DIR, env=env)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the backend benchmark against local stand-ins")
+    parser.add_argument("--port", type=int, default=8100, help="backend port")
+    parser.add_argument("--openai-port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake OpenAI seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    add_arguments(parser)
+    args = parser.parse_args()
+    args.base_url = f"http://127.0.0.1:{args.port}"
+
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+        "OPENAI_API_KEY": "bench",
+        # Keep measurements about the server, not about cache hits on repeated prompts
+        "RESPONSE_CACHE_ENABLED": env.get("RESPONSE_CACHE_ENABLED", "false"),
+        # Virtual users chat back to back, far faster than the per-user rate limit allows
+        "ADMISSION_RATE_PER_MINUTE": env.get("ADMISSION_RATE_PER_MINUTE", "100000"),
+    })
+
+    fake = start("bench.fake_openai", [
+        "--port", str(args.openai_port),
+        "--latency", str(args.latency),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--completion-tokens", str(args.completion_tokens),
+        "--error-rate", str(args.error_rate),
+    ], env)
+    server = None
+    try:
+        wait_for(f"http://127.0.0.1:{args.openai_port}/stats")
+        server = start("bench.server", ["--port", str(args.port)], env)
+        wait_for(f"{args.base_url}/")
+        status = run_load(args)
+        upstream = httpx.get(f"http://127.0.0.1:{args.openai_port}/stats").json()
+        print(
+            f"upstream: {upstream['requests']} requests, {upstream['prompt_tokens']} prompt tokens, "
+            f"{upstream['cached_tokens']} served from the prompt cache"
+        )
+        return status
+    finally:
+        for process in (server, fake):
+            if process is not None:
+                process.terminate()
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+Runs the backend against the in-memory Mongo stand-in, for benchmarks.
+
+OpenAI calls go wherever OPENAI_BASE_URL points (normally bench.fake_openai).
+
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 OPENAI_API_KEY=bench python -m bench.server --port 8100
+"""
+import argparse
+import os
+from contextlib import asynccontextmanager
+
+import uvicorn
+
+import services.session_service
+from bench.memory_mongo import MemoryMongoClient
+
+# Must happen before main (and with it SessionService) is imported
+services.session_service.AsyncIOMotorClient = MemoryMongoClient
+
+from main import app  # noqa: E402
+from api.routes import session_search  # noqa: E402
+
+app_lifespan = app.router.lifespan_context
+
+
+@asynccontextmanager
+async def lifespan(app):
+    async with app_lifespan(app):
+        # Every start is a fresh database: stands in for migrate_schema.py
+        await session_search.ensure_indexes()
+        yield
+
+app.router.lifespan_context = lifespan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend with in-memory MongoDB")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--log-level", default=os.getenv("BENCH_LOG_LEVEL", "warning"))
+    args = parser.parse_args()
+
+    # A single process without reload: the in-memory database is per process
+    uvicorn.run(app, host=args.host, port=args.port, log_level=args.log_level, access_log=False)
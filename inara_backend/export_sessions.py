@@ -0,0 +1,118 @@
+"""
+Streams sessions (with their history) to an NDJSON file, one session per line.
+
+    python export_sessions.py --out sessions.ndjson.gz --images-dir images/
+    python export_sessions.py --out u42.ndjson.zst --user-id u42 --updated-from 2026-01-01
+    python export_sessions.py --out sessions.ndjson.gz --resume    # continue an interrupted export
+
+Compression is taken from the file extension (.gz, .zst) unless --compression is given.
+Output is written in batches, each a complete gzip member / zstd frame, and after every
+batch the position is saved to <out>.checkpoint. --resume truncates the file back to the
+last checkpoint and continues from there, so no session is lost or written twice.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+import orjson
+from services.export_service import SessionExporter, compressor, strip_images
+from services.session_service import SessionService
+
+
+def _compression_for(path: str) -> str:
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return "none"
+
+
+def _save_checkpoint(path: str, state: dict):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+async def export(args) -> int:
+    compression = args.compression or _compression_for(args.out)
+    checkpoint_path = f"{args.out}.checkpoint"
+    state = {"checkpoint": None, "offset": 0, "exported": 0}
+    if args.resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            state = json.load(f)
+    elif os.path.exists(checkpoint_path):
+        # A fresh export: a leftover checkpoint would not match the new file
+        os.remove(checkpoint_path)
+    if args.images_dir:
+        os.makedirs(args.images_dir, exist_ok=True)
+
+    exporter = SessionExporter(SessionService(), batch_size=args.batch_size)
+    sessions = exporter.iter_sessions(
+        user_id=args.user_id,
+        updated_from=args.updated_from,
+        updated_to=args.updated_to,
+        checkpoint=state["checkpoint"]
+    )
+
+    mode = "r+b" if args.resume and os.path.exists(args.out) else "wb"
+    with open(args.out, mode) as out:
+        # Drop whatever was written after the last checkpoint
+        out.truncate(state["offset"])
+        out.seek(state["offset"])
+
+        batch_compressor = None
+        in_batch = 0
+        async for session in sessions:
+            if args.images_dir:
+                session = await exporter.externalize_images(session, args.images_dir)
+            elif args.images == "inline":
+                session["history"] = await exporter.sessions.blobs.inline_images(session["history"])
+            elif args.images == "omit":
+                session["history"] = strip_images(session["history"])
+
+            if batch_compressor is None:
+                batch_compressor = compressor(compression)
+            out.write(batch_compressor.compress(orjson.dumps(session) + b"\n"))
+            in_batch += 1
+            state["checkpoint"] = session["_checkpoint"]
+
+            if in_batch >= args.batch_size:
+                out.write(batch_compressor.flush())
+                batch_compressor, in_batch = None, 0
+                _commit(out, checkpoint_path, state, args.batch_size)
+
+        if batch_compressor is not None:
+            out.write(batch_compressor.flush())
+            _commit(out, checkpoint_path, state, in_batch)
+
+    print(f"Exported {state['exported']} sessions to {args.out}", file=sys.stderr)
+    return 0
+
+
+def _commit(out, checkpoint_path: str, state: dict, count: int):
+    """Makes the batch durable, then records the position after it."""
+    out.flush()
+    os.fsync(out.fileno())
+    state["offset"] = out.tell()
+    state["exported"] += count
+    _save_checkpoint(checkpoint_path, state)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export sessions as NDJSON")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"])
+    parser.add_argument("--user-id")
+    parser.add_argument("--updated-from", type=datetime.fromisoformat, help="inclusive, UTC")
+    parser.add_argument("--updated-to", type=datetime.fromisoformat, help="exclusive, UTC")
+    parser.add_argument("--images", choices=["ref", "inline", "omit"], default="ref",
+                        help="keep blob references (default), inline them as base64, or drop images")
+    parser.add_argument("--images-dir", help="write images there as <sha256>.<ext>; implies --images ref")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--resume", action="store_true", help="continue from <out>.checkpoint")
+    sys.exit(asyncio.run(export(parser.parse_args())))
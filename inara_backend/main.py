@@ -1,9 +1,49 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from api.routes import router as chat_router
+from api.routes import (
+    router as chat_router, session_service, llm_service, title_worker, image_processor
+)
+from services.image_service import UploadLimitMiddleware
+from services.metrics import MetricsMiddleware, render as render_metrics, worker_exiting
 import uvicorn
 
-app = FastAPI(title="Inara AI Backend")
+logger = logging.getLogger("uvicorn.error")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # Clients are created here, inside the worker process and its event loop, not at import time
+    session_service.connect()
+    llm_service.connect()
+    # Fail startup right away if MongoDB is unreachable, rather than on the first request
+    await session_service.ping()
+    connected = time.perf_counter()
+    # Make sure the indexes backing session lookups and listings exist before serving.
+    # Search indexes scan whole collections to build: they are created by migrate_schema.py
+    await session_service.ensure_indexes()
+    indexed = time.perf_counter()
+    # Open the first provider connection and start the image workers before traffic arrives
+    await asyncio.gather(llm_service.warm_up(), image_processor.warm_up())
+    title_worker.start()
+    ready = time.perf_counter()
+    logger.info(
+        "Startup complete in %.2fs (mongo %.2fs, indexes %.2fs, warm-up %.2fs)",
+        ready - started, connected - started, indexed - connected, ready - indexed
+    )
+    yield
+    # Runs once the server has stopped accepting and in-flight requests have finished.
+    # Finish pending title jobs so none are lost on redeploy
+    await title_worker.stop()
+    image_processor.shutdown()
+    await llm_service.close()
+    session_service.close()
+    worker_exiting()
+
+app = FastAPI(title="Inara AI Backend", lifespan=lifespan)
 
 # CORS middleware to allow requests from Flutter (or any origin for dev)
 app.add_middleware(
@@ -12,7 +52,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+# Refuse oversized bodies before FastAPI parses (and spools) the multipart form
+app.add_middleware(UploadLimitMiddleware)
+# Outermost, so latency includes every other middleware and the full response body
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(chat_router, prefix="/api")
 
@@ -20,5 +65,12 @@ app.include_router(chat_router, prefix="/api")
 def read_root():
     return {"status": "online", "service": "Inara AI Backend"}
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus scrape endpoint: per-route and per-stage latency, payload sizes, token usage, in-flight gauges."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 if __name__ == "__main__":
+    # Development server with auto-reload; run serve.py in production
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,25 @@
+"""
+Moves embedded session histories into the 'messages' collection.
+
+Rollout:
+1. Run migrate_schema.py: migrated turns are numbered from each session's stored
+   message_count, which it backfills.
+2. Deploy with SESSION_STORAGE=messages. Sessions that still embed their history keep
+   working and are migrated on their next append.
+3. Run this script to migrate the rest. It is idempotent and safe to run while serving:
+
+       python migrate_messages.py
+"""
+import asyncio
+from services.session_service import SessionService
+
+
+async def main():
+    service = SessionService(storage="messages")
+    await service.ensure_indexes()
+    migrated = await service.migrate_to_messages()
+    print(f"Migrated {migrated} sessions to the messages collection")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+"""
+One-off database migrations, kept out of the app's startup so that workers start without
+scanning collections. Run it once per environment before deploying a version that needs it;
+it is idempotent and safe to run while serving:
+
+    python migrate_schema.py
+
+- Sets the stored message_count on sessions created before it was maintained (listings and
+  history paging read it).
+- Builds the search indexes: titles on 'sessions', turn text on 'messages' and 'turn_text'.
+  Drops the older 'session_text' index, which covered whole embedded histories.
+- Fills 'turn_text' from embedded histories written before it was maintained.
+- Records which sessions reference each stored image ('refs' on 'blobs'), so deleting a
+  session deletes its images, then deletes the images no session references any more.
+  Run it once every worker writes 'refs' (images uploaded meanwhile are kept).
+"""
+import asyncio
+from datetime import datetime
+from services.search_service import SessionSearch
+from services.session_service import SessionService
+
+
+async def main():
+    service = SessionService()
+    await service.ensure_indexes()
+    await service.backfill_message_counts()
+    print("Backfilled message counts")
+    await SessionSearch(service).ensure_indexes()
+    print("Built search indexes")
+    scanned = await service.index_turn_text()
+    print(f"Indexed the turn text of {scanned} embedded sessions")
+    started = datetime.utcnow()
+    sessions = await service.backfill_blob_refs()
+    deleted = await service.blobs.delete_untracked(started)
+    print(f"Recorded image references of {sessions} sessions, deleted {deleted} unreferenced images")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
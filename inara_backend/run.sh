@@ -16,9 +16,12 @@ fi
 # Activate virtual environment
 source venv/bin/activate
 
-# Install dependencies
-echo "Installing dependencies..."
-pip install -r requirements.txt
+# Install dependencies, only when requirements.txt changed since the last install
+REQUIREMENTS_STAMP="venv/.requirements.sha256"
+if ! sha256sum --check --status "$REQUIREMENTS_STAMP" 2> /dev/null; then
+    echo "Installing dependencies..."
+    pip install -r requirements.txt && sha256sum requirements.txt > "$REQUIREMENTS_STAMP"
+fi
 
 # Create .env from example if not exists
 if [ ! -f ".env" ]; then
@@ -27,6 +30,10 @@ if [ ! -f ".env" ]; then
     echo "PLEASE EDIT .env AND ADD YOUR GOOGLE_API_KEY"
 fi
 
-# Run the server
+# Run the server: ./run.sh for development (auto-reload), ./run.sh prod for serve.py
+# (workers from WEB_CONCURRENCY, graceful shutdown on SIGTERM)
 echo "Starting server..."
-uvicorn main:app --host 0.0.0.0 --port 8000 --reload
+if [ "$1" = "prod" ]; then
+    exec python serve.py
+fi
+exec uvicorn main:app --host 0.0.0.0 --port 8000 --reload
@@ -0,0 +1,103 @@
+"""
+Production entry point: several worker processes, no reload, graceful shutdown.
+
+    python serve.py --workers 4
+    WEB_CONCURRENCY=4 GRACEFUL_SHUTDOWN_TIMEOUT=60 python serve.py --port 8000
+
+uvloop and httptools are used when installed (see requirements.txt), the asyncio loop and
+h11 otherwise. Each worker creates its own MongoDB and OpenAI clients in the app's lifespan,
+pings MongoDB (startup fails if it is unreachable) and warms up the provider connection and
+image workers before accepting requests. Pool sizes are set with MONGO_MAX_POOL_SIZE,
+MONGO_MIN_POOL_SIZE, OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS and
+OPENAI_KEEPALIVE_EXPIRY, per worker.
+
+On SIGTERM (or SIGINT) the server stops accepting connections and lets in-flight requests,
+including streamed answers, finish for up to --timeout-graceful-shutdown seconds. Then the
+lifespan shutdown drains the title queue and closes the clients.
+
+With more than one worker, Prometheus samples are shared through PROMETHEUS_MULTIPROC_DIR so
+that /metrics covers all workers. A temporary directory is used unless the variable is set,
+and it is emptied at every start.
+
+Cold start (process start until the first request is served) is measured with
+bench/coldstart.py, see bench/README.md.
+"""
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def _prepare_multiprocess_metrics():
+    """Returns the temporary directory to remove on exit, if one was created."""
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        # Samples of a previous run's workers would otherwise be added to this run's
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return None
+    path = tempfile.mkdtemp(prefix="inara-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    return path
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the backend in production mode")
+    parser.add_argument("--app", default="main:app", help="import string of the ASGI app")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--timeout-graceful-shutdown", type=int,
+                        default=int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30")),
+                        help="seconds in-flight requests get to finish on SIGTERM")
+    parser.add_argument("--timeout-keep-alive", type=int, default=int(os.getenv("KEEP_ALIVE_TIMEOUT", "75")),
+                        help="seconds an idle client connection is kept open; above the load balancer's idle timeout")
+    parser.add_argument("--forwarded-allow-ips", default=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+                        help="proxies whose X-Forwarded-For is trusted for client addresses")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    parser.add_argument("--no-access-log", action="store_true")
+    args = parser.parse_args()
+
+    loop = "uvloop" if _installed("uvloop") else "asyncio"
+    http = "httptools" if _installed("httptools") else "h11"
+
+    metrics_dir = None
+    if args.workers > 1:
+        metrics_dir = _prepare_multiprocess_metrics()
+
+    print(f"Starting {args.workers} worker(s) on {args.host}:{args.port} (loop={loop}, http={http})",
+          file=sys.stderr)
+    try:
+        uvicorn.run(
+            args.app,
+            app_dir=BACKEND_DIR,
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            loop=loop,
+            http=http,
+            reload=False,
+            timeout_graceful_shutdown=args.timeout_graceful_shutdown,
+            timeout_keep_alive=args.timeout_keep_alive,
+            proxy_headers=True,
+            forwarded_allow_ips=args.forwarded_allow_ips,
+            log_level=args.log_level,
+            access_log=not args.no_access_log
+        )
+    finally:
+        if metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Tuple
+from services.metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, STAGE_DURATION
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Sustained chat requests per user and minute, and how many may come in a burst
+ADMISSION_RATE_PER_MINUTE = float(os.getenv("ADMISSION_RATE_PER_MINUTE", "30"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "10"))
+# Chat requests generating at once in this worker; the rest wait in the fair-share queue
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", os.getenv("LLM_MAX_CONCURRENCY", "32")))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_MAX_QUEUE_PER_USER = int(os.getenv("ADMISSION_MAX_QUEUE_PER_USER", "4"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+# Requests served per round-robin turn for specific users, e.g. "team-a=4,ops=2" (default 1)
+ADMISSION_WEIGHTS = os.getenv("ADMISSION_WEIGHTS", "")
+ADMISSION_MAX_TRACKED_USERS = int(os.getenv("ADMISSION_MAX_TRACKED_USERS", "100000"))
+
+
+def parse_weights(spec: str) -> Dict[str, int]:
+    """Parses "user=weight,..." into a dict, ignoring malformed entries."""
+    weights = {}
+    for item in spec.split(","):
+        key, _, weight = item.strip().rpartition("=")
+        if key and weight.isdigit() and int(weight) > 0:
+            weights[key] = int(weight)
+    return weights
+
+
+class AdmissionRejected(Exception):
+    """A request was turned away by the admission layer; callers should answer 429."""
+
+    def __init__(self, message: str, retry_after: float, reason: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RateLimitBackend(ABC):
+    """State interface for per-user token buckets."""
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """Takes 'cost' tokens from key's bucket. Returns 0 if allowed, else seconds until it would be."""
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Per-process buckets, least recently used ones forgotten (i.e. reset to full) past max_keys."""
+
+    def __init__(self, max_keys: int = ADMISSION_MAX_TRACKED_USERS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= cost:
+            tokens -= cost
+            wait = 0.0
+        else:
+            wait = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class FairScheduler:
+    """
+    Grants up to 'slots' concurrent holders. When all are taken, waiters queue per user and freed
+    slots go round-robin across users, 'weight' grants per user and turn, so a user with many
+    queued requests cannot starve one with a single request.
+    """
+
+    def __init__(self, slots: int, weights: Dict[str, int] = None):
+        self.slots = slots
+        self.weights = weights or {}
+        self.active = 0
+        self.queued = 0
+        self._queues: Dict[str, Deque[asyncio.Future]] = {}
+        # Users with waiters, the next one to be served first
+        self._ring: Deque[str] = deque()
+        # Grants left for the user at the head of the ring in the current turn
+        self._credit = 0
+
+    def queued_for(self, key: str) -> int:
+        return len(self._queues.get(key, ()))
+
+    async def acquire(self, key: str, timeout: float):
+        """Waits for a slot. Raises asyncio.TimeoutError if none was granted within timeout."""
+        if self.active < self.slots and not self.queued:
+            self.active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        if key not in self._queues:
+            self._queues[key] = deque()
+            self._ring.append(key)
+        self._queues[key].append(waiter)
+        self.queued += 1
+        ADMISSION_QUEUE_DEPTH.inc()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException:
+            if waiter.done():
+                # Granted just as we gave up: pass the slot on
+                self.release()
+            else:
+                waiter.cancel()
+                self._discard(key, waiter)
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.active < self.slots and self._ring:
+            key = self._ring[0]
+            queue = self._queues[key]
+            waiter = queue.popleft()
+            self.queued -= 1
+            ADMISSION_QUEUE_DEPTH.dec()
+            if self._credit <= 0:
+                self._credit = self.weights.get(key, 1)
+            self._credit -= 1
+            if not queue:
+                del self._queues[key]
+                self._ring.popleft()
+                self._credit = 0
+            elif self._credit <= 0:
+                self._ring.rotate(-1)
+            waiter.set_result(None)
+            self.active += 1
+
+    def _discard(self, key: str, waiter: asyncio.Future):
+        queue = self._queues.get(key)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self.queued -= 1
+        ADMISSION_QUEUE_DEPTH.dec()
+        if not queue:
+            del self._queues[key]
+            if self._ring[0] == key:
+                self._credit = 0
+            self._ring.remove(key)
+
+
+class AdmissionController:
+    """
+    Admission in front of LLM work: a token-bucket rate limit per user, then a fair-share queue
+    for this worker's generation slots. Requests over their rate, or finding the queue (or their
+    own share of it) full, are rejected at once with a Retry-After estimate rather than queued.
+
+    Bucket state lives in a pluggable backend: in memory per worker by default, a shared store
+    makes the rate limit hold across workers. The queue is per worker, like the slots it guards.
+    """
+
+    def __init__(self, backend: RateLimitBackend = None, enabled: bool = ADMISSION_ENABLED,
+                 rate_per_minute: float = ADMISSION_RATE_PER_MINUTE, burst: float = ADMISSION_BURST,
+                 max_concurrency: int = ADMISSION_MAX_CONCURRENCY, max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_queue_per_user: int = ADMISSION_MAX_QUEUE_PER_USER,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, weights: Dict[str, int] = None):
+        self.backend = backend or InMemoryRateLimitBackend()
+        self.enabled = enabled
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self.scheduler = FairScheduler(
+            max_concurrency, weights if weights is not None else parse_weights(ADMISSION_WEIGHTS)
+        )
+        # Moving average of how long a slot is held, for Retry-After estimates
+        self.hold_seconds = 1.0
+        self.counters: Dict[str, int] = {"admitted": 0, "queued": 0, "rate_limited": 0, "queue_full": 0,
+                                         "queue_timeout": 0}
+
+    def _reject(self, reason: str, message: str, retry_after: float):
+        self.counters[reason] += 1
+        ADMISSION_REJECTED.labels(reason).inc()
+        raise AdmissionRejected(message, retry_after, reason)
+
+    def _queue_wait_estimate(self, ahead: int) -> float:
+        return self.hold_seconds * (ahead + 1) / max(self.scheduler.slots, 1)
+
+    async def check(self, key: str):
+        """
+        Takes a token from key's bucket and checks there is room to queue.
+        Raises AdmissionRejected without waiting otherwise.
+        """
+        if not self.enabled:
+            return
+        wait = await self.backend.take(key, self.rate, self.burst)
+        if wait > 0:
+            self._reject("rate_limited", "Too many requests, please slow down", wait)
+        scheduler = self.scheduler
+        if scheduler.active >= scheduler.slots:
+            if scheduler.queued >= self.max_queue:
+                self._reject("queue_full", "Server busy, please retry shortly",
+                             self._queue_wait_estimate(scheduler.queued))
+            if scheduler.queued_for(key) >= self.max_queue_per_user:
+                self._reject("queue_full", "Too many requests in progress, please wait for an answer",
+                             self._queue_wait_estimate(scheduler.queued_for(key)))
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        """Holds one of this worker's generation slots, waiting for its fair turn if all are taken."""
+        if not self.enabled:
+            yield
+            return
+        scheduler = self.scheduler
+        started = time.monotonic()
+        if scheduler.active >= scheduler.slots or scheduler.queued:
+            self.counters["queued"] += 1
+        try:
+            await scheduler.acquire(key, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout", "Server busy, please retry shortly",
+                         self._queue_wait_estimate(scheduler.queued))
+        granted = time.monotonic()
+        STAGE_DURATION.labels("admission.wait").observe(granted - started)
+        self.counters["admitted"] += 1
+        try:
+            yield
+        finally:
+            self.hold_seconds = 0.9 * self.hold_seconds + 0.1 * (time.monotonic() - granted)
+            scheduler.release()
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "enabled": self.enabled,
+            "active": self.scheduler.active,
+            "waiting": self.scheduler.queued,
+            "waiting_users": len(self.scheduler._ring),
+            "max_concurrency": self.scheduler.slots,
+            "avg_hold_seconds": round(self.hold_seconds, 3)
+        }
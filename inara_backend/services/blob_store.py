@@ -0,0 +1,140 @@
+import base64
+import hashlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from bson.binary import Binary
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from services.metrics import STORED_DOCUMENT_SIZE, timed
+
+
+class BlobStore:
+    """
+    Content-addressed storage for uploaded images.
+    Bytes are stored once in the 'blobs' collection, keyed by their SHA-256 digest,
+    and session history only keeps an 'image_ref' part pointing at them.
+    Each blob lists the sessions referencing it in 'refs'; deleting the last of them
+    deletes the blob (see release()).
+    """
+
+    def __init__(self, db=None):
+        self.collection = None
+        if db is not None:
+            self.bind(db)
+
+    def bind(self, db):
+        self.collection = db.get_collection("blobs")
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("refs", ASCENDING)])
+
+    @timed("mongo.blob_put")
+    async def put(self, data: bytes, mime_type: str, session_id: str) -> Dict:
+        """
+        Stores the bytes (if not already present), records that session_id references them
+        and returns the reference to keep in 'parts'.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        STORED_DOCUMENT_SIZE.labels("blob").observe(len(data))
+        try:
+            # $setOnInsert makes identical re-uploads a no-op, apart from the new reference
+            await self.collection.update_one(
+                {"_id": digest},
+                {
+                    "$setOnInsert": {
+                        "mime_type": mime_type,
+                        "size": len(data),
+                        "data": Binary(data),
+                        "created_at": datetime.utcnow()
+                    },
+                    "$addToSet": {"refs": session_id}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # A concurrent upload of the same bytes won the upsert race
+            pass
+        return {"sha256": digest, "mime_type": mime_type, "size": len(data)}
+
+    async def add_refs(self, digests: Iterable[str], session_id: str):
+        """Records references from session_id to blobs stored before references were tracked."""
+        wanted = list(set(digests))
+        if wanted:
+            await self.collection.update_many({"_id": {"$in": wanted}}, {"$addToSet": {"refs": session_id}})
+
+    @timed("mongo.blob_release")
+    async def release(self, session_id: str) -> int:
+        """
+        Drops session_id's references and deletes the blobs no other session references.
+        An upload of the same bytes racing with this re-adds its reference first (the
+        delete then spares the blob) or re-creates the blob after. Returns the number deleted.
+        """
+        cursor = self.collection.find({"refs": session_id}, {"_id": 1})
+        digests = [doc["_id"] async for doc in cursor]
+        if not digests:
+            return 0
+        await self.collection.update_many({"_id": {"$in": digests}}, {"$pull": {"refs": session_id}})
+        result = await self.collection.delete_many({"_id": {"$in": digests}, "refs": {"$size": 0}})
+        return result.deleted_count
+
+    async def delete_untracked(self, created_before: datetime) -> int:
+        """
+        Deletes blobs without 'refs' created before created_before: after add_refs() has been
+        run for every stored session, those are referenced by no session. Returns the number deleted.
+        """
+        result = await self.collection.delete_many(
+            {"refs": {"$exists": False}, "created_at": {"$lt": created_before}}
+        )
+        return result.deleted_count
+
+    @timed("mongo.blob_get")
+    async def get_blob(self, digest: str) -> Optional[Dict]:
+        """The stored blob as {"data": bytes, "mime_type": str}, or None."""
+        doc = await self.collection.find_one({"_id": digest}, {"data": 1, "mime_type": 1})
+        return {"data": bytes(doc["data"]), "mime_type": doc["mime_type"]} if doc else None
+
+    @timed("mongo.blob_get_many")
+    async def get_many(self, digests: Iterable[str]) -> Dict[str, bytes]:
+        """Fetches several blobs in a single round trip."""
+        wanted = list(set(digests))
+        if not wanted:
+            return {}
+        cursor = self.collection.find({"_id": {"$in": wanted}}, {"data": 1})
+        return {doc["_id"]: bytes(doc["data"]) async for doc in cursor}
+
+    async def inline_images(self, history: List[Dict]) -> List[Dict]:
+        """
+        Returns a copy of history with 'image_ref' parts replaced by base64 'inline_data' parts,
+        the format the OpenAI conversion and API clients expect. Legacy inline parts pass through.
+        """
+        digests = [
+            part["image_ref"]["sha256"]
+            for turn in history
+            for part in turn.get("parts", [])
+            if "image_ref" in part
+        ]
+        if not digests:
+            return history
+
+        blobs = await self.get_many(digests)
+        hydrated = []
+        for turn in history:
+            parts = []
+            for part in turn.get("parts", []):
+                if "image_ref" in part:
+                    ref = part["image_ref"]
+                    data = blobs.get(ref["sha256"])
+                    if data is None:
+                        # Blob missing; drop the part rather than failing the whole turn
+                        continue
+                    # Keep any annotations on the part (e.g. requested image detail)
+                    hydrated_part = {k: v for k, v in part.items() if k != "image_ref"}
+                    hydrated_part["inline_data"] = {
+                        "mime_type": ref["mime_type"],
+                        "data": base64.b64encode(data).decode('utf-8')
+                    }
+                    parts.append(hydrated_part)
+                else:
+                    parts.append(part)
+            hydrated.append({**turn, "parts": parts})
+        return hydrated
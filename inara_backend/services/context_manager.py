@@ -0,0 +1,173 @@
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# Tokens of conversation context (summary + history + current turn) sent per request.
+# The system prompt is not counted against it.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "16000"))
+# Number of most recent images kept at full detail; older kept images are sent at low detail
+CONTEXT_FULL_DETAIL_IMAGES = int(os.getenv("CONTEXT_FULL_DETAIL_IMAGES", "2"))
+# Images are re-graded only every this many turns. Lowering an image's detail changes the request
+# from that image on and so invalidates the provider's prompt cache past it; doing it in steps
+# keeps the prefix byte-stable between steps.
+CONTEXT_DETAIL_STEP = int(os.getenv("CONTEXT_DETAIL_STEP", "8"))
+# When the window has to slide, shrink it to this fraction of the budget so the summary
+# is folded again only every few turns rather than on every request
+CONTEXT_FOLD_TARGET = float(os.getenv("CONTEXT_FOLD_TARGET", "0.75"))
+
+# Approximate OpenAI vision costs: a high-detail image tiled at 768px vs. a fixed low-detail image
+IMAGE_TOKENS_HIGH = 765
+IMAGE_TOKENS_LOW = 85
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to a character-based estimate
+    tiktoken = None
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Counts tokens with tiktoken when available, otherwise estimates ~4 characters per token."""
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def is_image_part(part: Dict) -> bool:
+    return "image_ref" in part or "inline_data" in part
+
+
+def turn_tokens(turn: Dict, image_tokens: int = IMAGE_TOKENS_HIGH) -> int:
+    """Token cost of a stored history turn."""
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    for part in turn.get("parts", []):
+        if "text" in part:
+            tokens += count_tokens(part["text"])
+        elif is_image_part(part):
+            tokens += IMAGE_TOKENS_LOW if part.get("detail") == "low" else image_tokens
+    return tokens
+
+
+@dataclass
+class ContextWindow:
+    """Which part of the history to send, and what has to be folded into the summary first."""
+    turns: List[Dict]
+    # Turns sliding out of the window that are not covered by the summary yet
+    fold: List[Dict] = field(default_factory=list)
+    # Number of history turns the summary will cover once 'fold' is folded in
+    summary_through: int = 0
+    tokens_full: int = 0
+    tokens_used: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.tokens_full - self.tokens_used, 0)
+
+
+class ContextManager:
+    """
+    Keeps the context sent upstream within a token budget.
+    The most recent turns that fit are sent verbatim, older images are downsampled,
+    and turns that slide out of the window are folded into a rolling summary
+    stored on the session as {"text": ..., "through": <number of turns covered>}.
+
+    Everything it decides only changes at fold points or detail steps, so between those the
+    request is the previous request plus the new turns: a prefix the provider can cache.
+    """
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET,
+                 full_detail_images: int = CONTEXT_FULL_DETAIL_IMAGES,
+                 fold_target: float = CONTEXT_FOLD_TARGET,
+                 detail_step: int = CONTEXT_DETAIL_STEP):
+        self.budget = budget
+        self.full_detail_images = full_detail_images
+        self.fold_target = fold_target
+        self.detail_step = max(detail_step, 1)
+
+    def select(self, history: List[Dict], summary: Optional[Dict], current_tokens: int,
+               history_offset: int = 0, history_tokens: int = 0) -> ContextWindow:
+        """
+        Chooses the window of history to send alongside the summary and the current turn.
+        'history' starts at turn history_offset of the conversation (the summary is relative to it).
+        'history_tokens' is the cost of the whole conversation, for tokens_full when 'history' is
+        only its tail.
+        """
+        through = min(summary["through"], len(history)) if summary else 0
+        summary_tokens = count_tokens(summary["text"]) if summary else 0
+        costs = [turn_tokens(turn) for turn in history]
+        tokens_full = max(sum(costs), history_tokens) + current_tokens
+
+        available = self.budget - summary_tokens - current_tokens
+        start = through
+        if sum(costs[start:]) > available:
+            # Slide the window past the budget, down to the fold target, so that the next
+            # few turns fit without folding again
+            target = available * self.fold_target
+            remaining = sum(costs[start:])
+            while start < len(history) and remaining > target:
+                remaining -= costs[start]
+                start += 1
+            # Never open the window on a model turn
+            while start < len(history) and history[start].get("role") == "model":
+                start += 1
+
+        # Only turns before the last detail step are re-graded; newer ones keep full detail until then
+        graded = (history_offset + len(history)) // self.detail_step * self.detail_step - history_offset
+        turns = self._downsample_images(history[start:], graded - start)
+        fold = history[through:start]
+        tokens_used = sum(turn_tokens(turn) for turn in turns) + current_tokens
+        if summary or fold:
+            # The summary is at most as long as the previous one plus a bounded update
+            tokens_used += summary_tokens
+        return ContextWindow(
+            turns=turns,
+            fold=fold,
+            summary_through=start if fold else through,
+            tokens_full=tokens_full,
+            tokens_used=tokens_used
+        )
+
+    def _downsample_images(self, turns: List[Dict], graded: int) -> List[Dict]:
+        """
+        Marks all but the most recent images among the first 'graded' turns as low detail.
+        Returns copies; input is not modified.
+        """
+        remaining_full = self.full_detail_images
+        result = []
+        for index in range(len(turns) - 1, -1, -1):
+            turn = turns[index]
+            parts = []
+            for part in reversed(turn.get("parts", [])):
+                if is_image_part(part) and index < graded:
+                    if remaining_full > 0:
+                        remaining_full -= 1
+                    else:
+                        part = {**part, "detail": "low"}
+                parts.append(part)
+            result.append({**turn, "parts": list(reversed(parts))})
+        result.reverse()
+        return result
+
+
+def render_turns_for_summary(turns: List[Dict], max_chars_per_turn: int = 2000) -> str:
+    """Plain-text transcript of turns for the summarizer; images are noted but not sent."""
+    lines = []
+    for turn in turns:
+        speaker = "Assistant" if turn.get("role") == "model" else "Doctor"
+        texts = []
+        for part in turn.get("parts", []):
+            if "text" in part:
+                texts.append(part["text"][:max_chars_per_turn])
+            elif is_image_part(part):
+                texts.append("[image attached]")
+        lines.append(f"{speaker}: {' '.join(texts)}")
+    return "\n\n".join(lines)
@@ -0,0 +1,138 @@
+import base64
+import hashlib
+import os
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+from pymongo import ASCENDING
+from services.session_service import SessionService, decode_cursor, encode_cursor
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for zstd-compressed exports
+    zstandard = None
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "100"))
+
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+
+
+class _Identity:
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def compressor(compression: str):
+    """
+    A fresh streaming compressor (compress/flush). Each one produces a complete gzip member
+    or zstd frame, and concatenations of those are valid files.
+    """
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    if compression == "none":
+        return _Identity()
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+class SessionExporter:
+    """
+    Streams sessions with their history in (updated_at, session_id) order, reading through a
+    batched cursor so memory stays bounded by one batch regardless of the dataset size.
+    Each exported session carries a '_checkpoint' that resumes the export right after it.
+    Sessions updated while an export runs may appear again later in it; keep the last copy.
+    """
+
+    def __init__(self, session_service: SessionService, batch_size: int = EXPORT_BATCH_SIZE):
+        self.sessions = session_service
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _query(user_id: Optional[str], updated_from: Optional[datetime], updated_to: Optional[datetime],
+               checkpoint: Optional[str]) -> Dict:
+        query: Dict = {}
+        if user_id:
+            query["user_id"] = user_id
+        if updated_from or updated_to:
+            query["updated_at"] = {}
+            if updated_from:
+                query["updated_at"]["$gte"] = updated_from
+            if updated_to:
+                query["updated_at"]["$lt"] = updated_to
+        if checkpoint:
+            updated_at, session_id = decode_cursor(checkpoint)
+            query["$or"] = [
+                {"updated_at": {"$gt": updated_at}},
+                {"updated_at": updated_at, "session_id": {"$gt": session_id}}
+            ]
+        return query
+
+    async def iter_sessions(self, user_id: str = None, updated_from: datetime = None,
+                            updated_to: datetime = None, checkpoint: str = None) -> AsyncIterator[Dict]:
+        query = self._query(user_id, updated_from, updated_to, checkpoint)
+        cursor = self.sessions.collection.find(query, {"_id": 0}).sort(
+            [("updated_at", ASCENDING), ("session_id", ASCENDING)]
+        ).batch_size(self.batch_size)
+        async for session in cursor:
+            if "history" not in session:
+                # Turns live in the 'messages' collection
+                session["history"] = await self.sessions.get_history(session["session_id"])
+            session["_checkpoint"] = encode_cursor(session)
+            yield session
+
+    async def externalize_images(self, session: Dict, images_dir: str) -> Dict:
+        """
+        Writes the session's images to images_dir as <sha256>.<ext> (once each) and leaves only
+        'image_ref' parts in its history. Legacy inline images are moved out the same way.
+        """
+        missing = []
+        history = []
+        for turn in session.get("history", []):
+            parts = []
+            for part in turn.get("parts", []):
+                if "inline_data" in part:
+                    data = base64.b64decode(part["inline_data"]["data"])
+                    mime_type = part["inline_data"]["mime_type"]
+                    ref = {"sha256": hashlib.sha256(data).hexdigest(), "mime_type": mime_type, "size": len(data)}
+                    self._write_image(images_dir, ref, data)
+                    part = {k: v for k, v in part.items() if k != "inline_data"}
+                    part["image_ref"] = ref
+                elif "image_ref" in part and not os.path.exists(self._image_path(images_dir, part["image_ref"])):
+                    missing.append(part["image_ref"])
+                parts.append(part)
+            history.append({**turn, "parts": parts})
+
+        if missing:
+            blobs = await self.sessions.blobs.get_many(ref["sha256"] for ref in missing)
+            for ref in missing:
+                if ref["sha256"] in blobs:
+                    self._write_image(images_dir, ref, blobs[ref["sha256"]])
+        return {**session, "history": history}
+
+    @staticmethod
+    def _image_path(images_dir: str, ref: Dict) -> str:
+        return os.path.join(images_dir, f"{ref['sha256']}.{EXTENSIONS.get(ref['mime_type'], 'bin')}")
+
+    def _write_image(self, images_dir: str, ref: Dict, data: bytes):
+        path = self._image_path(images_dir, ref)
+        if os.path.exists(path):
+            return
+        # Write-then-rename so an interrupted export never leaves a truncated image behind
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+def strip_images(history: List[Dict]) -> List[Dict]:
+    """History with image parts (referenced or inline) removed."""
+    return [
+        {**turn, "parts": [p for p in turn.get("parts", []) if "image_ref" not in p and "inline_data" not in p]}
+        for turn in history
+    ]
@@ -0,0 +1,97 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def message_size(message: Optional[Dict]) -> int:
+    """Approximate in-memory size of a converted message, dominated by text and data: URLs."""
+    if not message:
+        return 0
+    content = message["content"]
+    if isinstance(content, str):
+        return len(content)
+    size = 0
+    for item in content:
+        if item["type"] == "text":
+            size += len(item["text"])
+        else:
+            size += len(item["image_url"]["url"])
+    return size
+
+
+@dataclass
+class _Entry:
+    # History index of the first cached message
+    offset: int
+    # Converted message per history turn from 'offset' on (None for turns with no content)
+    messages: List[Optional[Dict]]
+    nbytes: int
+
+    @property
+    def end(self) -> int:
+        return self.offset + len(self.messages)
+
+
+class HistoryCache:
+    """
+    Bounded LRU cache of history already converted to OpenAI messages, per session.
+    History is append-only, so a request only converts (and hydrates images for) the turns
+    added since the cached entry. Entries are evicted by total byte size.
+    """
+
+    def __init__(self, max_bytes: int = HISTORY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id: str, start: int, length: int) -> List[Optional[Dict]]:
+        """
+        Returns the cached converted messages for history turns [start, ...) of a session
+        whose history currently has 'length' turns. Empty list on a miss.
+        """
+        entry = self._entries.get(session_id)
+        if entry is None or entry.offset > start or entry.end > length or entry.end <= start:
+            if entry is not None and entry.end > length:
+                # History shrank (e.g. rewritten); the entry no longer matches
+                self.invalidate(session_id)
+            self.misses += 1
+            return []
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        return entry.messages[start - entry.offset:]
+
+    def put(self, session_id: str, start: int, messages: List[Optional[Dict]]):
+        """Stores the converted messages for history turns [start, start + len(messages))."""
+        self.invalidate(session_id)
+        nbytes = sum(message_size(m) for m in messages)
+        if nbytes > self.max_bytes:
+            return
+        self._entries[session_id] = _Entry(offset=start, messages=messages, nbytes=nbytes)
+        self._bytes += nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def invalidate(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import os
+from typing import Awaitable, Callable, Dict, Tuple
+from services.response_cache import CacheBackend, InMemoryCacheBackend
+
+# How long a completed result is replayed for a repeated key
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "3600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different request."""
+
+
+def fingerprint(*fields) -> str:
+    """Hash identifying a request's payload, to tell a retry from a reused key."""
+    digest = hashlib.sha256()
+    for value in fields:
+        digest.update(value if isinstance(value, bytes) else str(value).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class IdempotentRequests:
+    """
+    Runs each request identified by an idempotency key at most once.
+    A duplicate that arrives while the first is still running waits for the same result;
+    one that arrives after it completed gets the stored result, for 'ttl' seconds.
+    Failures are not stored, so a retry after an error runs the request again.
+
+    The work runs in its own task: if the client that started it goes away, it still completes
+    (and is persisted) for the retry that follows. In-flight requests are coalesced per process;
+    completed results are shared through the backend.
+    """
+
+    def __init__(self, backend: CacheBackend = None, ttl: float = IDEMPOTENCY_TTL):
+        self.backend = backend or InMemoryCacheBackend(max_entries=IDEMPOTENCY_MAX_ENTRIES)
+        self.ttl = ttl
+        self._in_flight: Dict[str, Tuple[str, asyncio.Task]] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.replayed = 0
+        self.conflicts = 0
+
+    @staticmethod
+    def _check(expected: str, actual: str):
+        if expected != actual:
+            raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+
+    async def run(self, key: str, request_fingerprint: str,
+                  fn: Callable[[], Awaitable[Dict]]) -> Tuple[Dict, bool]:
+        """
+        Returns (result, replayed): fn()'s result, or that of an earlier run with the same key.
+        Raises IdempotencyConflict if the key was used with a different fingerprint.
+        """
+        try:
+            if key not in self._in_flight:
+                stored = await self.backend.get(key)
+                if stored is not None:
+                    self._check(stored["fingerprint"], request_fingerprint)
+                    self.replayed += 1
+                    return stored["result"], True
+
+            # Checked after the backend lookup, which may have yielded to a duplicate
+            in_flight = self._in_flight.get(key)
+            if in_flight:
+                self._check(in_flight[0], request_fingerprint)
+                self.coalesced += 1
+                return await asyncio.shield(in_flight[1]), True
+        except IdempotencyConflict:
+            self.conflicts += 1
+            raise
+
+        task = asyncio.create_task(self._execute(key, request_fingerprint, fn))
+        # Nobody may be left waiting for a failure (the caller went away): mark it as retrieved
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._in_flight[key] = (request_fingerprint, task)
+        self.executed += 1
+        return await asyncio.shield(task), False
+
+    async def _execute(self, key: str, request_fingerprint: str, fn: Callable[[], Awaitable[Dict]]) -> Dict:
+        try:
+            result = await fn()
+            await self.backend.set(key, {"fingerprint": request_fingerprint, "result": result}, self.ttl)
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict:
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+            "conflicts": self.conflicts,
+            "in_flight": len(self._in_flight)
+        }
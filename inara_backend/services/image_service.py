@@ -0,0 +1,180 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from fastapi import UploadFile
+from fastapi.responses import JSONResponse
+from PIL import Image, ImageOps
+
+# Hard cap on the raw upload, enforced while reading
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Cap on a whole request body (the upload plus the other form fields and multipart framing),
+# enforced by UploadLimitMiddleware before the body is parsed
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(MAX_UPLOAD_BYTES + 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# The vision model fits images within 2048x2048 and then scales the short side to 768px,
+# so anything larger is only wasted bytes
+IMAGE_MAX_LONG_SIDE = int(os.getenv("IMAGE_MAX_LONG_SIDE", "2048"))
+IMAGE_MAX_SHORT_SIDE = int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Refuse to decode anything beyond this many pixels (decompression bombs)
+Image.MAX_IMAGE_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(80_000_000)))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidImage(Exception):
+    pass
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Reads an upload in chunks, failing as soon as it exceeds max_bytes."""
+    buffer = bytearray()
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return bytes(buffer)
+        buffer.extend(chunk)
+        if len(buffer) > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware rejecting request bodies larger than max_bytes with 413 before the app
+    parses them: multipart parsing spools every file to disk before read_upload() sees it.
+    A declared Content-Length is refused without reading the body; a body without one
+    (chunked) is counted as it arrives and refused once it passes the limit.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def _reject(self, scope, receive, send):
+        detail = f"Request exceeds the {self.max_bytes // (1024 * 1024)} MB limit"
+        await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        declared = next(
+            (int(value) for name, value in scope["headers"] if name == b"content-length" and value.isdigit()), None
+        )
+        if declared is not None and declared > self.max_bytes:
+            await self._reject(scope, receive, send)
+            return
+
+        state = {"received": 0, "exceeded": False, "started": False}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > self.max_bytes:
+                    state["exceeded"] = True
+                    raise UploadTooLarge(f"Request exceeds the {self.max_bytes} byte limit")
+            return message
+
+        async def send_wrapper(message):
+            # Drop the error response the app makes of the aborted body; the 413 is sent instead
+            if state["exceeded"] and not state["started"]:
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except UploadTooLarge:
+            if state["started"]:
+                raise
+        if state["exceeded"] and not state["started"]:
+            await self._reject(scope, receive, send)
+
+
+def _target_size(size: Tuple[int, int]) -> Tuple[int, int]:
+    width, height = size
+    scale = min(
+        1.0,
+        IMAGE_MAX_LONG_SIDE / max(width, height),
+        IMAGE_MAX_SHORT_SIDE / min(width, height)
+    )
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def preprocess_image(data: bytes) -> Tuple[bytes, str]:
+    """
+    Decodes an image, applies its EXIF orientation, downscales it to the resolution the
+    vision model uses and re-encodes it as JPEG without metadata.
+    Runs in a worker process; returns (image_bytes, mime_type).
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # Let the JPEG decoder skip detail we are about to throw away
+            # (draft never goes below the requested size)
+            img.draft("RGB", _target_size(img.size))
+            img = ImageOps.exif_transpose(img)
+
+            if img.mode in ("RGBA", "LA", "P"):
+                # Flatten transparency onto white; JPEG has no alpha channel
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+
+            target = _target_size(img.size)
+            if img.size != target:
+                img = img.resize(target, Image.LANCZOS)
+
+            out = io.BytesIO()
+            # No exif/icc arguments: metadata is dropped
+            img.save(out, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+            return out.getvalue(), "image/jpeg"
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImage(f"Could not process image: {e}") from e
+
+
+def _ready() -> bool:
+    return True
+
+
+class ImageProcessor:
+    """Runs CPU-bound image preprocessing in a process pool so the event loop is never blocked."""
+
+    def __init__(self, workers: int = IMAGE_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a process that already runs Motor/asyncio threads is not safe
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def warm_up(self):
+        """Starts the worker processes (each pays for a fresh interpreter and Pillow import) before the first upload."""
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        await asyncio.gather(*(loop.run_in_executor(pool, _ready) for _ in range(self.workers)))
+
+    async def process(self, data: bytes) -> Tuple[bytes, str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_pool(), preprocess_image, data)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
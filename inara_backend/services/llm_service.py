@@ -1,15 +1,104 @@
 import os
+import json
 import base64
-from openai import AsyncOpenAI
+import asyncio
+import logging
+import time
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
+from services.blob_store import BlobStore
+from services.context_manager import (
+    ContextManager, count_tokens, is_image_part, render_turns_for_summary, IMAGE_TOKENS_HIGH, MESSAGE_OVERHEAD_TOKENS
+)
+from services.history_cache import HistoryCache
+from services.metrics import STAGE_DURATION, record_usage, stage, timed
+from services.response_cache import ResponseCache
+from services.upstream import UpstreamClient
 
 load_dotenv()
 
-# Initialize OpenAI client
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
+
+SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "800"))
+# Send the session id as 'prompt_cache_key' so a consultation's requests are routed to the same
+# provider cache; disable for OpenAI-compatible endpoints that reject the parameter
+PROMPT_CACHE_KEY_ENABLED = os.getenv("PROMPT_CACHE_KEY_ENABLED", "true").lower() == "true"
+# Connection pool to the provider per worker: keep-alive connections are reused across calls,
+# so only the first requests pay for the TLS handshake
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+# Seconds an idle connection is kept open
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+# At startup, look up the model once to open a connection and check the key; failures only log
+LLM_WARMUP = os.getenv("LLM_WARMUP", "true").lower() == "true"
+LLM_WARMUP_TIMEOUT = float(os.getenv("LLM_WARMUP_TIMEOUT", "5"))
+# Appended to stored answers that were cut short when they are sent back as history
+INTERRUPTED_NOTE = "[This answer was interrupted before it was completed.]"
+
+
+def create_openai_client() -> AsyncOpenAI:
+    """OpenAI client with the configured connection pool (key and base URL from the environment)."""
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+        ))
+    )
+
+@dataclass
+class Prompt:
+    """A prepared request: the OpenAI messages plus context-window bookkeeping."""
+    messages: list
+    # Updated rolling summary to persist on the session, or None if unchanged
+    summary: Optional[Dict] = None
+    # Tokens left out of the request by windowing, summarizing and image downsampling
+    tokens_saved: int = 0
+    # Response cache key, set only for cacheable (stateless, text-only) requests
+    cache_key: Optional[str] = None
+    # Set once the response has been served from the cache
+    cache_hit: bool = False
+    # Session the request belongs to, used to route it to the provider's prompt cache
+    session_id: Optional[str] = None
+    # Provider token usage of every call made for this turn (summary and response), see add_usage()
+    usage: Dict[str, int] = field(default_factory=dict)
+
+def add_usage(totals: Dict[str, int], usage) -> None:
+    """Adds prompt, completion and cached token counts from an OpenAI 'usage' object (may be None)."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    counts = {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0
+    }
+    for name, count in counts.items():
+        totals[name] = totals.get(name, 0) + count
 
 class LLMService:
-    def __init__(self):
+    def __init__(self, blob_store: BlobStore = None, context: ContextManager = None,
+                 history_cache: HistoryCache = None, response_cache: ResponseCache = None,
+                 upstream: UpstreamClient = None, connect: bool = True):
+        """With connect=False the OpenAI client is created later by connect(), e.g. in the app's lifespan."""
+        # Used to hydrate image references in history right before they are sent upstream
+        self.blob_store = blob_store
+        # Keeps the history sent upstream within the configured token budget
+        self.context = context or ContextManager()
+        # Already-converted history per session, so each turn only converts what is new
+        self.history_cache = history_cache or HistoryCache()
+        # Exact-match answers to stateless first-turn questions
+        self.response_cache = response_cache or ResponseCache()
+        # Concurrency bound, deadlines, retries and circuit breaker around every provider call
+        self.upstream = upstream or UpstreamClient()
+        if connect and self.upstream.client is None:
+            self.connect()
+
         # System instruction for Inara Persona with strict medical guardrails
         self.system_instruction = """You are Inara, an advanced AI Clinical Assistant designed exclusively for doctors and healthcare professionals.
 
@@ -44,100 +133,330 @@ Remember: You are a medical assistant ONLY. Politely redirect any non-medical qu
         
         self.model = "gpt-5.2"
 
-    def _convert_history_to_openai_format(self, history: list) -> list:
-        """Convert stored history format to OpenAI messages format."""
-        messages = []
+    def connect(self, client: AsyncOpenAI = None):
+        self.upstream.bind(client or create_openai_client())
+
+    async def warm_up(self) -> bool:
+        """
+        Opens the first provider connection (DNS, TLS) before traffic arrives and checks the key.
+        Returns False, after logging, if the provider could not be reached: the app starts anyway.
+        """
+        if not LLM_WARMUP:
+            return False
+        try:
+            await asyncio.wait_for(self.upstream.client.models.retrieve(self.model), LLM_WARMUP_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.warning("LLM warm-up failed: %s", e)
+            return False
+
+    async def close(self):
+        if self.upstream.client is not None:
+            await self.upstream.client.close()
+
+    def _convert_turn(self, turn: dict) -> Optional[dict]:
+        """Convert one stored history turn (with hydrated images) to an OpenAI message, or None if empty."""
+        role = "assistant" if turn.get("role") == "model" else "user"
+        parts = turn.get("parts", [])
         
-        for turn in history:
-            role = "assistant" if turn.get("role") == "model" else "user"
-            parts = turn.get("parts", [])
-            
-            content = []
-            for part in parts:
-                if "text" in part:
-                    content.append({
-                        "type": "text",
-                        "text": part["text"]
-                    })
-                elif "inline_data" in part:
-                    # Handle image data from history
-                    inline_data = part["inline_data"]
-                    content.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{inline_data['mime_type']};base64,{inline_data['data']}"
-                        }
-                    })
-            
-            if content:
-                # If only text content, simplify to string
-                if len(content) == 1 and content[0]["type"] == "text":
-                    messages.append({
-                        "role": role,
-                        "content": content[0]["text"]
-                    })
-                else:
-                    messages.append({
-                        "role": role,
-                        "content": content
-                    })
+        content = []
+        for part in parts:
+            if "text" in part:
+                content.append({
+                    "type": "text",
+                    "text": part["text"]
+                })
+            elif "inline_data" in part:
+                # Handle image data from history
+                inline_data = part["inline_data"]
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{inline_data['mime_type']};base64,{inline_data['data']}"
+                    }
+                })
         
-        return messages
+        if turn.get("truncated") and role == "assistant":
+            # Tell the model its earlier answer was cut off, rather than letting it read as complete
+            # (or, with no text at all, leaving the question looking unanswered)
+            text = "\n\n".join(item["text"] for item in content if item["type"] == "text")
+            return {"role": role, "content": f"{text}\n\n{INTERRUPTED_NOTE}" if text else INTERRUPTED_NOTE}
+
+        if not content:
+            return None
+        # If only text content, simplify to string
+        if len(content) == 1 and content[0]["type"] == "text":
+            return {
+                "role": role,
+                "content": content[0]["text"]
+            }
+        return {
+            "role": role,
+            "content": content
+        }
 
-    async def generate_response(self, message: str, history: list = [], image_data: bytes = None, mime_type: str = None) -> str:
+    @staticmethod
+    def _apply_image_detail(message: dict, turn: dict) -> dict:
+        """Applies the image detail chosen by the context manager, copying only messages that change."""
+        details = [part.get("detail") for part in turn.get("parts", []) if is_image_part(part)]
+        if not any(details) or isinstance(message["content"], str):
+            return message
+        content = []
+        images = iter(details)
+        for item in message["content"]:
+            if item["type"] == "image_url":
+                detail = next(images, None)
+                if detail:
+                    item = {"type": "image_url", "image_url": {**item["image_url"], "detail": detail}}
+            content.append(item)
+        return {**message, "content": content}
+
+    async def _convert_window(self, session_id: Optional[str], history: list, turns: list,
+                              history_offset: int = 0) -> list:
+        """
+        Convert the window of history turns to OpenAI messages.
+        Turns converted on earlier requests come from the history cache, so only the turns
+        added since then are hydrated from the blob store and converted.
+        The cache is indexed by position in the full history, history_offset turns before 'history'.
+        """
+        start = history_offset + len(history) - len(turns)
+        length = history_offset + len(history)
+        cached = self.history_cache.get(session_id, start, length) if session_id else []
+
+        new_turns = history[start - history_offset + len(cached):]
+        if self.blob_store:
+            new_turns = await self.blob_store.inline_images(new_turns)
+        converted = cached + [self._convert_turn(turn) for turn in new_turns]
+        if session_id:
+            self.history_cache.put(session_id, start, converted)
+
+        return [
+            self._apply_image_detail(message, turn)
+            for message, turn in zip(converted, turns)
+            if message
+        ]
+
+    @timed("llm.summarize")
+    async def _summarize(self, previous_summary: Optional[str], turns: list,
+                         usage: Optional[Dict[str, int]] = None) -> Optional[str]:
+        """
+        Folds turns into the rolling summary of the consultation. Returns None on failure.
+        Token usage of the call is added to 'usage' if given.
+        """
         try:
-            # Build messages array starting with system message
+            transcript = render_turns_for_summary(turns)
+            if previous_summary:
+                content = f"Existing summary:\n{previous_summary}\n\nNew conversation turns to fold in:\n\n{transcript}"
+            else:
+                content = f"Conversation turns to summarize:\n\n{transcript}"
             messages = [
                 {
                     "role": "system",
-                    "content": self.system_instruction
+                    "content": "You maintain a running summary of a clinical consultation between a doctor and an AI assistant. Update the summary with the new turns. Preserve every clinically relevant fact: patient details, symptoms, findings (including what attached images showed), lab values, medications and doses, diagnoses considered, and recommendations given. Be concise and factual. Return only the updated summary."
+                },
+                {
+                    "role": "user",
+                    "content": content
                 }
             ]
-            
-            # Add conversation history
-            history_messages = self._convert_history_to_openai_format(history)
-            messages.extend(history_messages)
-            
-            # Build current user message
-            if image_data and mime_type:
-                # Message with image
-                b64_image = base64.b64encode(image_data).decode('utf-8')
-                user_content = [
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{mime_type};base64,{b64_image}"
-                        }
-                    },
-                    {
-                        "type": "text",
-                        "text": message
-                    }
-                ]
-                messages.append({
-                    "role": "user",
-                    "content": user_content
-                })
-            else:
-                # Text-only message
-                messages.append({
-                    "role": "user",
-                    "content": message
-                })
-            
-            # Call OpenAI API
-            response = await client.chat.completions.create(
+
+            response = await self.upstream.create(
                 model=self.model,
                 messages=messages,
-                max_completion_tokens=4096,
-                temperature=0.7
+                max_completion_tokens=SUMMARY_MAX_TOKENS,
+                temperature=0.2
             )
-            
-            return response.choices[0].message.content
-            
+            record_usage("summary", response.usage)
+            if usage is not None:
+                add_usage(usage, response.usage)
+
+            return response.choices[0].message.content.strip() or None
+
         except Exception as e:
-            return f"Error generating response: {str(e)}"
+            logger.warning("Failed to update conversation summary: %s", e)
+            return None
+
+    @timed("llm.build_prompt")
+    async def build_prompt(self, message: str, history: list, image_data: bytes = None, mime_type: str = None,
+                           summary: Optional[Dict] = None, session_id: str = None, use_cache: bool = True,
+                           history_offset: int = 0, history_tokens: int = 0) -> Prompt:
+        """
+        Build the full OpenAI messages array: system prompt, rolling summary, the window of recent
+        history that fits the token budget, and the current user turn.
+        'history' may be the tail of the conversation starting at turn history_offset, as long as it
+        covers every turn the summary does not; history_tokens, the token cost of the whole
+        conversation, is then what tokens_saved is measured against.
+        The messages are laid out for the provider's prompt cache: the fixed system prompt, then the
+        summary and the window, which only change at fold points and image detail steps, then the new
+        turn. In between, each request starts with the previous one, byte for byte.
+        Requests with no history and no image may be answered from the response cache
+        unless use_cache is False.
+        """
+        current_tokens = count_tokens(message) + MESSAGE_OVERHEAD_TOKENS + (IMAGE_TOKENS_HIGH if image_data else 0)
+        if summary and history_offset:
+            summary = {**summary, "through": summary["through"] - history_offset}
+        window = self.context.select(history, summary, current_tokens, history_offset, history_tokens)
+
+        usage: Dict[str, int] = {}
+        new_summary = None
+        if window.fold:
+            previous_text = summary["text"] if summary else None
+            text = await self._summarize(previous_text, window.fold, usage)
+            if text:
+                new_summary = {"text": text, "through": window.summary_through + history_offset}
+                window.tokens_used += count_tokens(text) - (count_tokens(previous_text) if previous_text else 0)
+            # On failure the folded turns are left out this time and folding is retried next turn
+        summary = new_summary or summary
+
+        messages = [
+            {
+                "role": "system",
+                "content": self.system_instruction
+            }
+        ]
 
+        if summary:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the earlier part of this consultation:\n{summary['text']}"
+            })
+
+        # Add conversation history (only the turns actually sent need their images hydrated)
+        history_messages = await self._convert_window(session_id, history, window.turns, history_offset)
+        messages.extend(history_messages)
+
+        # Build current user message
+        if image_data and mime_type:
+            # Message with image
+            b64_image = base64.b64encode(image_data).decode('utf-8')
+            user_content = [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{b64_image}"
+                    }
+                },
+                {
+                    "type": "text",
+                    "text": message
+                }
+            ]
+            messages.append({
+                "role": "user",
+                "content": user_content
+            })
+        else:
+            # Text-only message
+            messages.append({
+                "role": "user",
+                "content": message
+            })
+
+        if window.tokens_saved:
+            logger.info("Context window saved %d of %d tokens", window.tokens_saved, window.tokens_full)
+        cache_key = None
+        if use_cache and self.response_cache.enabled and not history and not summary and not image_data:
+            cache_key = self.response_cache.key(message, self.model, self.system_instruction)
+        return Prompt(
+            messages=messages, summary=new_summary, tokens_saved=window.tokens_saved, cache_key=cache_key,
+            session_id=session_id, usage=usage
+        )
+
+    async def _cached_response(self, prompt: Prompt) -> Optional[str]:
+        if not prompt.cache_key:
+            return None
+        cached = await self.response_cache.get(prompt.cache_key)
+        prompt.cache_hit = cached is not None
+        return cached
+
+    @staticmethod
+    def _cache_routing(prompt: Prompt) -> dict:
+        """Extra request parameters routing a session's requests to the same provider prompt cache."""
+        if PROMPT_CACHE_KEY_ENABLED and prompt.session_id:
+            return {"prompt_cache_key": prompt.session_id}
+        return {}
+
+    async def complete(self, prompt: Prompt) -> str:
+        """
+        Generates the full response for a prepared prompt.
+        Raises UpstreamUnavailable when the provider is unhealthy or saturated.
+        """
+        cached = await self._cached_response(prompt)
+        if cached is not None:
+            return cached
+
+        started = time.monotonic()
+        # Call OpenAI API
+        with stage("llm.complete"):
+            response = await self.upstream.create(
+                model=self.model,
+                messages=prompt.messages,
+                max_completion_tokens=4096,
+                temperature=0.7,
+                **self._cache_routing(prompt)
+            )
+        record_usage("chat", response.usage)
+        add_usage(prompt.usage, response.usage)
+        
+        text = response.choices[0].message.content
+        if prompt.cache_key and text:
+            await self.response_cache.put(prompt.cache_key, text, time.monotonic() - started)
+        return text
+
+    async def stream(self, prompt: Prompt) -> AsyncIterator[str]:
+        """
+        Streams the response for a prepared prompt as it is generated, yielding text deltas.
+        Errors are raised to the caller, which decides how to report them mid-stream.
+        """
+        cached = await self._cached_response(prompt)
+        if cached is not None:
+            yield cached
+            return
+
+        started = time.monotonic()
+        chunks = []
+        upstream_chunks = self.upstream.stream(
+            model=self.model,
+            messages=prompt.messages,
+            max_completion_tokens=4096,
+            temperature=0.7,
+            # The final chunk then carries the token usage
+            stream_options={"include_usage": True},
+            **self._cache_routing(prompt)
+        )
+        # Closing this generator early (the client went away) closes the upstream stream right away
+        async with aclosing(upstream_chunks):
+            async for chunk in upstream_chunks:
+                if chunk.usage:
+                    record_usage("chat", chunk.usage)
+                    add_usage(prompt.usage, chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not chunks:
+                        STAGE_DURATION.labels("llm.stream_first_token").observe(time.monotonic() - started)
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        STAGE_DURATION.labels("llm.stream").observe(time.monotonic() - started)
+
+        # Only complete responses are cached
+        if prompt.cache_key and chunks:
+            await self.response_cache.put(prompt.cache_key, "".join(chunks), time.monotonic() - started)
+
+    @staticmethod
+    def _clean_title(title: str) -> str:
+        title = title.strip()
+        # Clean up the title - remove quotes if present
+        title = title.strip('"\'')
+        # Limit to 50 chars
+        if len(title) > 50:
+            title = title[:47] + "..."
+        return title
+
+    @staticmethod
+    def fallback_title(user_message: str) -> str:
+        """Title used when generation fails: the truncated user message."""
+        return user_message[:47] + "..." if len(user_message) > 50 else user_message
+
+    @timed("llm.title")
     async def generate_title(self, user_message: str, ai_response: str) -> str:
         """Generate a concise title summarizing the conversation."""
         try:
@@ -152,21 +471,63 @@ Remember: You are a medical assistant ONLY. Politely redirect any non-medical qu
                 }
             ]
             
-            response = await client.chat.completions.create(
+            response = await self.upstream.create(
                 model=self.model,
                 messages=messages,
                 max_completion_tokens=50,
                 temperature=0.5
             )
+            record_usage("title", response.usage)
             
-            title = response.choices[0].message.content.strip()
-            # Clean up the title - remove quotes if present
-            title = title.strip('"\'')
-            # Limit to 50 chars
-            if len(title) > 50:
-                title = title[:47] + "..."
-            return title
+            return self._clean_title(response.choices[0].message.content)
             
         except Exception as e:
+            logger.warning("Failed to generate session title: %s", e)
             # Fallback to truncated user message
-            return user_message[:47] + "..." if len(user_message) > 50 else user_message
+            return self.fallback_title(user_message)
+
+    @timed("llm.titles")
+    async def generate_titles(self, exchanges: List[Tuple[str, str]]) -> List[str]:
+        """
+        Generate titles for several (user_message, ai_response) exchanges with a single LLM call.
+        Returns one title per exchange, in order, falling back per exchange on any failure.
+        """
+        if len(exchanges) == 1:
+            return [await self.generate_title(*exchanges[0])]
+
+        try:
+            conversations = "\n\n".join(
+                f"[{i}]\nUser: {user_message[:200]}\nAssistant: {ai_response[:300]}"
+                for i, (user_message, ai_response) in enumerate(exchanges)
+            )
+            messages = [
+                {
+                    "role": "system",
+                    "content": "You are a helpful assistant that generates very short, concise titles. For each numbered conversation, generate a title that summarizes its topic in 3-6 words. Do not use quotes or punctuation in the titles. Respond with a JSON object of the form {\"titles\": [\"...\", ...]} containing exactly one title per conversation, in order."
+                },
+                {
+                    "role": "user",
+                    "content": f"Generate short titles for these {len(exchanges)} conversations:\n\n{conversations}"
+                }
+            ]
+
+            response = await self.upstream.create(
+                model=self.model,
+                messages=messages,
+                max_completion_tokens=50 * len(exchanges),
+                temperature=0.5,
+                response_format={"type": "json_object"}
+            )
+            record_usage("title", response.usage)
+
+            titles = json.loads(response.choices[0].message.content)["titles"]
+            if len(titles) != len(exchanges):
+                raise ValueError(f"Expected {len(exchanges)} titles, got {len(titles)}")
+            return [
+                self._clean_title(str(title)) or self.fallback_title(user_message)
+                for title, (user_message, _) in zip(titles, exchanges)
+            ]
+
+        except Exception as e:
+            logger.warning("Failed to generate %d session titles: %s", len(exchanges), e)
+            return [self.fallback_title(user_message) for user_message, _ in exchanges]
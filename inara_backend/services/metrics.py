@@ -0,0 +1,180 @@
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+)
+
+# Set when running several worker processes; each writes its samples there and /metrics aggregates them
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = tuple(2 ** n for n in range(8, 26, 2))  # 256 B .. 16 MB
+TOKEN_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "inara_http_request_duration_seconds", "HTTP request latency, until the response body is fully sent",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+HTTP_REQUEST_SIZE = Histogram(
+    "inara_http_request_size_bytes", "HTTP request body size (from Content-Length)",
+    ["method", "route"], buckets=SIZE_BUCKETS
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    "inara_http_response_size_bytes", "HTTP response body size as sent",
+    ["method", "route"], buckets=SIZE_BUCKETS
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "inara_http_requests_in_flight", "HTTP requests being handled",
+    ["method"], multiprocess_mode="livesum"
+)
+STAGE_DURATION = Histogram(
+    "inara_stage_duration_seconds", "Latency of an internal stage (MongoDB call, LLM call, image processing...)",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+STORED_DOCUMENT_SIZE = Histogram(
+    "inara_stored_document_bytes", "BSON size of documents written to MongoDB",
+    ["kind"], buckets=SIZE_BUCKETS
+)
+IMAGE_SIZE = Histogram(
+    "inara_image_bytes", "Image size as uploaded and after preprocessing",
+    ["stage"], buckets=SIZE_BUCKETS
+)
+LLM_TOKENS = Histogram(
+    "inara_llm_tokens", "Tokens per LLM call, from the provider's usage field",
+    ["operation", "kind"], buckets=TOKEN_BUCKETS
+)
+LLM_CALLS_IN_FLIGHT = Gauge(
+    "inara_llm_calls_in_flight", "LLM calls holding a concurrency slot", multiprocess_mode="livesum"
+)
+LLM_CALLS_WAITING = Gauge(
+    "inara_llm_calls_waiting", "LLM calls waiting for a concurrency slot", multiprocess_mode="livesum"
+)
+LLM_CALLS_CANCELLED = Counter(
+    "inara_llm_calls_cancelled", "LLM calls and streams abandoned before completion (e.g. the client went away)"
+)
+CLIENT_DISCONNECTS = Counter(
+    "inara_client_disconnects", "Chat requests whose client disconnected before the answer was complete",
+    ["endpoint"]
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "inara_admission_queue_depth", "Chat requests waiting for a generation slot", multiprocess_mode="livesum"
+)
+ADMISSION_REJECTED = Counter(
+    "inara_admission_rejected", "Chat requests rejected with 429 by the admission layer", ["reason"]
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "inara_response_cache_lookups", "Response cache lookups for first-turn queries, by result (hit/miss)",
+    ["result"]
+)
+RESPONSE_CACHE_SAVED_SECONDS = Counter(
+    "inara_response_cache_saved_seconds", "Upstream latency avoided by response cache hits (as recorded with each entry)"
+)
+TITLE_QUEUE_DEPTH = Gauge(
+    "inara_title_queue_depth", "Title generation jobs waiting to be processed", multiprocess_mode="livesum"
+)
+
+
+@contextmanager
+def stage(name: str):
+    """Times the enclosed block into the stage latency histogram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(name).observe(time.perf_counter() - started)
+
+
+def timed(name: str):
+    """Decorator form of stage() for coroutine functions."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_usage(operation: str, usage) -> None:
+    """Records prompt, completion and cached token counts from an OpenAI 'usage' object (may be None)."""
+    if usage is None:
+        return
+    LLM_TOKENS.labels(operation, "prompt").observe(usage.prompt_tokens or 0)
+    LLM_TOKENS.labels(operation, "completion").observe(usage.completion_tokens or 0)
+    details = getattr(usage, "prompt_tokens_details", None)
+    LLM_TOKENS.labels(operation, "cached").observe(getattr(details, "cached_tokens", None) or 0)
+
+
+def render() -> Tuple[bytes, str]:
+    """The current metrics in Prometheus text format, with their content type."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def worker_exiting() -> None:
+    """Drops this process's live gauges from the aggregated metrics when several workers share PROMETHEUS_MULTIPROC_DIR."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route latency, request/response sizes and in-flight requests.
+    Routes are labelled by their path template (e.g. /api/sessions/{session_id}) to keep cardinality
+    bounded; latency covers the whole response, including streamed bodies.
+    The template is only known once routing is done, so the in-flight gauge is per method.
+    """
+
+    def __init__(self, app, skip_paths=("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    @staticmethod
+    def _route_template(scope) -> str:
+        """The matched route's path template, as set by routing (e.g. /api/sessions/{session_id})."""
+        path_format = getattr(scope.get("route"), "path_format", None)
+        if not path_format:
+            return "unmatched"
+        # Routes of an included router carry their path without the include prefix: take the
+        # prefix from the leading segments of the request path (no route has a multi-segment parameter)
+        template = path_format.rstrip("/").split("/")
+        path = scope["path"].rstrip("/").split("/")
+        return "/".join(path[:len(path) - len(template) + 1] + template[1:]) or "/"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        request_size = next(
+            (int(value) for name, value in scope["headers"] if name == b"content-length" and value.isdigit()), 0
+        )
+        state: Dict[str, Optional[int]] = {"status": None, "bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                state["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            route = self._route_template(scope)
+            HTTP_REQUEST_DURATION.labels(method, route, str(state["status"] or 500)).observe(
+                time.perf_counter() - started
+            )
+            HTTP_REQUEST_SIZE.labels(method, route).observe(request_size)
+            HTTP_RESPONSE_SIZE.labels(method, route).observe(state["bytes"])
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import re
+import time
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from services.metrics import RESPONSE_CACHE_LOOKUPS, RESPONSE_CACHE_SAVED_SECONDS
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+
+
+class CacheBackend(ABC):
+    """Storage interface for ResponseCache. Values are plain dicts so they can be serialized."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Dict]:
+        """The value stored under key, or None if absent or expired."""
+
+    @abstractmethod
+    async def set(self, key: str, value: Dict, ttl: float):
+        """Stores value under key for ttl seconds."""
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """Per-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Dict]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Dict, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def normalize_message(text: str) -> str:
+    """Case- and whitespace-insensitive form of a message, so trivially different phrasings share a key."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class ResponseCache:
+    """
+    Exact-match cache of responses to stateless first-turn queries (no history, no image).
+    Keyed by the normalized message, the model and a hash of the system prompt, so changing
+    either invalidates old entries.
+    Hits, misses and the upstream latency hits saved are exported to /metrics (hit rate is
+    hits over all lookups); stats() has this worker's own totals.
+    """
+
+    def __init__(self, backend: CacheBackend = None, ttl: float = RESPONSE_CACHE_TTL,
+                 enabled: bool = RESPONSE_CACHE_ENABLED):
+        self.backend = backend or InMemoryCacheBackend()
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        # Upstream time the hits would have cost, from the latency recorded with each entry
+        self.saved_latency_seconds = 0.0
+
+    @staticmethod
+    def key(message: str, model: str, system_prompt: str) -> str:
+        system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        raw = f"{model}\0{system_hash}\0{normalize_message(message)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = await self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+            RESPONSE_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        self.hits += 1
+        RESPONSE_CACHE_LOOKUPS.labels("hit").inc()
+        saved = entry.get("latency", 0.0)
+        self.saved_latency_seconds += saved
+        RESPONSE_CACHE_SAVED_SECONDS.inc(saved)
+        return entry["response"]
+
+    async def put(self, key: str, response: str, latency: float):
+        await self.backend.set(key, {"response": response, "latency": latency}, self.ttl)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "saved_latency_seconds": round(self.saved_latency_seconds, 3)
+        }
@@ -0,0 +1,177 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from pymongo import ASCENDING
+from services.metrics import timed
+from services.session_service import SessionService
+
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "160"))
+# Sessions ranked per query. Every page is cut from this same ranking, whatever its offset,
+# so results do not move between pages; matches ranked below it are not returned.
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "200"))
+# Matching turns considered per candidate session, when ranking sessions by their turns
+SEARCH_TURNS_PER_RESULT = int(os.getenv("SEARCH_TURNS_PER_RESULT", "5"))
+# Title matches count more than a match somewhere in the conversation
+TITLE_WEIGHT = 5
+
+TEXT_SCORE = {"$meta": "textScore"}
+
+
+def query_terms(query: str) -> List[str]:
+    """Words of a search query that should appear in results (negated terms are dropped)."""
+    return [
+        word for token in query.split() if not token.startswith("-")
+        for word in re.findall(r"\w+", token.casefold())
+    ]
+
+
+def make_snippet(texts: List[str], terms: List[str], width: int = SEARCH_SNIPPET_CHARS) -> Optional[str]:
+    """
+    A window of text around the first occurrence of a query term.
+    Terms match on a prefix as well, so stemmed matches (dose/dosing) still get a snippet.
+    """
+    patterns = [re.compile(re.escape(term[:max(4, len(term) - 3)]), re.IGNORECASE) for term in terms]
+    for text in texts:
+        for pattern in patterns:
+            match = pattern.search(text)
+            if not match:
+                continue
+            start = max(match.start() - width // 3, 0)
+            end = min(start + width, len(text))
+            snippet = " ".join(text[start:end].split())
+            return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+    return None
+
+
+class SessionSearch:
+    """
+    Ranked full-text search over a user's sessions, backed by MongoDB text indexes that are
+    prefixed by user_id, so a query only touches that user's index entries.
+    Titles are indexed on 'sessions'; turn text on 'messages', or for embedded and archived
+    histories on 'turn_text', where each turn is written once (see SessionService). Session documents that
+    grow with every turn are never text-indexed. Only text fields are ever projected; image
+    data is never read.
+
+    Building the indexes scans the collections: ensure_indexes() runs from migrate_schema.py,
+    not at startup.
+    """
+
+    def __init__(self, session_service: SessionService):
+        self.sessions = session_service
+
+    async def ensure_indexes(self):
+        indexes = await self.sessions.collection.index_information()
+        if "session_text" in indexes:
+            # Earlier versions also indexed the embedded history here (re-tokenized on every append)
+            await self.sessions.collection.drop_index("session_text")
+        await self.sessions.collection.create_index(
+            [("user_id", ASCENDING), ("title", "text")],
+            name="session_title_text",
+            default_language="english"
+        )
+        await self.sessions.messages.create_index(
+            [("user_id", ASCENDING), ("parts.text", "text")],
+            name="message_text",
+            default_language="english"
+        )
+        await self.sessions.turn_text.create_index(
+            [("user_id", ASCENDING), ("text", "text")],
+            name="turn_text",
+            default_language="english"
+        )
+
+    async def _rank_sessions(self, user_id: str, query: str, want: int) -> List[Dict]:
+        cursor = self.sessions.collection.find(
+            {"user_id": user_id, "$text": {"$search": query}},
+            {"_id": 0, "session_id": 1, "score": TEXT_SCORE}
+        ).sort([("score", TEXT_SCORE)]).limit(want)
+        return [{**hit, "score": hit["score"] * TITLE_WEIGHT} for hit in await cursor.to_list(length=want)]
+
+    async def _rank_turns(self, user_id: str, query: str, want: int) -> List[Dict]:
+        """Best matching turns from both turn stores, as {session_id, score, texts}."""
+        limit = want * SEARCH_TURNS_PER_RESULT
+        query_filter = {"user_id": user_id, "$text": {"$search": query}}
+        messages = self.sessions.messages.find(
+            query_filter, {"_id": 0, "session_id": 1, "parts.text": 1, "score": TEXT_SCORE}
+        ).sort([("score", TEXT_SCORE)]).limit(limit)
+        turns = self.sessions.turn_text.find(
+            query_filter, {"_id": 0, "session_id": 1, "text": 1, "score": TEXT_SCORE}
+        ).sort([("score", TEXT_SCORE)]).limit(limit)
+        hits = [
+            {"session_id": hit["session_id"], "score": hit["score"],
+             "texts": [part["text"] for part in hit.get("parts", []) if "text" in part]}
+            for hit in await messages.to_list(length=limit)
+        ]
+        hits += [
+            {"session_id": hit["session_id"], "score": hit["score"], "texts": [hit["text"]]}
+            for hit in await turns.to_list(length=limit)
+        ]
+        hits.sort(key=lambda hit: -hit["score"])
+        return hits[:limit]
+
+    async def _history_texts(self, session_ids: List[str]) -> Dict[str, List[str]]:
+        """Text parts of embedded histories, for snippets (only the 'text' fields are loaded)."""
+        cursor = self.sessions.collection.find(
+            {"session_id": {"$in": session_ids}, "history": {"$exists": True}},
+            {"_id": 0, "session_id": 1, "history.parts.text": 1}
+        )
+        return {
+            doc["session_id"]: [
+                part["text"] for turn in doc.get("history", []) for part in turn.get("parts", []) if "text" in part
+            ]
+            async for doc in cursor
+        }
+
+    @timed("mongo.search")
+    async def search(self, user_id: str, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict], bool]:
+        """
+        Returns (results, has_more): sessions ranked by relevance, each with session metadata,
+        'score' and a 'snippet' of the best matching text (None when only the title matched).
+        """
+        terms = query_terms(query)
+        if not terms:
+            return [], False
+        # Independent of offset and limit: a session's score depends on how many of its turns are
+        # among the candidates, so ranking a page-dependent number would reorder results across pages
+        want = SEARCH_CANDIDATES
+
+        scores: Dict[str, float] = {}
+        texts: Dict[str, List[str]] = {}
+        for hit in await self._rank_sessions(user_id, query, want):
+            scores[hit["session_id"]] = hit["score"]
+        for hit in await self._rank_turns(user_id, query, want):
+            session_id = hit["session_id"]
+            # A session ranks by its best turn, plus a little for every further matching turn
+            best = scores.get(session_id, 0.0)
+            scores[session_id] = max(best, hit["score"]) + 0.1 * min(best, hit["score"])
+            texts.setdefault(session_id, []).extend(hit["texts"])
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        has_more = len(ranked) > offset + limit
+        page = ranked[offset:offset + limit]
+        if not page:
+            return [], has_more
+
+        page_ids = [session_id for session_id, _ in page]
+        metadata = {
+            doc["session_id"]: doc
+            async for doc in self.sessions.collection.find(
+                {"session_id": {"$in": page_ids}},
+                {"_id": 0, "session_id": 1, "title": 1, "created_at": 1, "updated_at": 1, "message_count": 1}
+            )
+        }
+        embedded = await self._history_texts([sid for sid in page_ids if sid not in texts])
+
+        results = []
+        for session_id, score in page:
+            session = metadata.get(session_id)
+            if session is None:
+                # Deleted since the index was read
+                continue
+            snippet_texts = texts.get(session_id) or embedded.get(session_id, [])
+            results.append({
+                **session,
+                "score": round(score, 3),
+                "snippet": make_snippet(snippet_texts, terms)
+            })
+        return results, has_more
@@ -0,0 +1,87 @@
+import os
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional
+import bson
+from bson.binary import Binary
+from services.metrics import STORED_DOCUMENT_SIZE, timed
+
+try:
+    import zstandard
+except ImportError:  # optional: archives fall back to zlib without it
+    zstandard = None
+
+# "zstd" (needs the 'zstandard' package) or "zlib"; archives record theirs, so either can be read back
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd" if zstandard is not None else "zlib")
+# Archives are written once and rarely read: favour ratio over speed
+ARCHIVE_ZSTD_LEVEL = int(os.getenv("ARCHIVE_ZSTD_LEVEL", "12"))
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd archives require the 'zstandard' package")
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(data)
+    if compression == "zlib":
+        return zlib.compress(data, 9)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd archives require the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compression == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+class SessionArchive:
+    """
+    Cold storage for the history of idle sessions, in the 'session_archive' collection: one
+    document per session holding its turns as compressed BSON. Nothing in it is indexed but
+    _id, so archived conversations cost neither index space nor working-set memory.
+    Image bytes stay in the blob store; archived turns keep their 'image_ref' parts.
+    """
+
+    def __init__(self, db=None, compression: str = ARCHIVE_COMPRESSION):
+        self.compression = compression
+        self.collection = None
+        if db is not None:
+            self.bind(db)
+
+    def bind(self, db):
+        self.collection = db.get_collection("session_archive")
+
+    def pack(self, history: List[Dict]) -> bytes:
+        return compress(bson.encode({"history": history}), self.compression)
+
+    @timed("mongo.archive_put")
+    async def put(self, session_id: str, user_id: Optional[str], history: List[Dict]) -> int:
+        """Stores the session's turns, replacing any earlier archive of it. Returns the compressed size."""
+        data = self.pack(history)
+        STORED_DOCUMENT_SIZE.labels("archive").observe(len(data))
+        await self.collection.update_one(
+            {"_id": session_id},
+            {"$set": {
+                "user_id": user_id,
+                "compression": self.compression,
+                "turns": len(history),
+                "data": Binary(data),
+                "archived_at": datetime.utcnow()
+            }},
+            upsert=True
+        )
+        return len(data)
+
+    @timed("mongo.archive_get")
+    async def get(self, session_id: str) -> Optional[List[Dict]]:
+        """The archived turns of a session, or None if it has no archive."""
+        doc = await self.collection.find_one({"_id": session_id}, {"compression": 1, "data": 1})
+        if doc is None:
+            return None
+        return bson.decode(decompress(bytes(doc["data"]), doc["compression"]))["history"]
+
+    async def delete(self, session_id: str):
+        await self.collection.delete_one({"_id": session_id})
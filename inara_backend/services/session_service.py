@@ -1,106 +1,629 @@
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 import uuid
 import os
+import json
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorClient
+import bson
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from dotenv import load_dotenv
+from services.blob_store import BlobStore
+from services.context_manager import turn_tokens
+from services.metrics import STORED_DOCUMENT_SIZE, timed
+from services.session_archive import SessionArchive
 
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI")
+# Connection pool per process (per worker): at most MONGO_MAX_POOL_SIZE concurrent operations,
+# MONGO_MIN_POOL_SIZE connections kept open even when idle
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+# How long an operation waits for a usable server before failing (e.g. Mongo down at startup)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+# Where conversation turns live:
+#   "embedded" - in the session document's 'history' array
+#   "messages" - one document per turn in the 'messages' collection, keyed by (session_id, seq);
+#                the session document only keeps metadata. Sessions still holding an embedded
+#                history are read as-is and moved over on their next append (see migrate_messages.py)
+SESSION_STORAGE = os.getenv("SESSION_STORAGE", "embedded")
+# Sessions not updated for this many days have their history moved to the archive (see archive_sessions.py)
+SESSION_ARCHIVE_AFTER_DAYS = float(os.getenv("SESSION_ARCHIVE_AFTER_DAYS", "90"))
+
+# Fields of a stored turn, as returned from the 'messages' collection
+MESSAGE_PROJECTION = {"_id": 0, "role": 1, "parts": 1, "timestamp": 1, "truncated": 1}
+
+# Fields needed to list sessions; 'history' is never loaded for listings
+SESSION_LIST_PROJECTION = {
+    "_id": 0,
+    "session_id": 1,
+    "user_id": 1,
+    "title": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "message_count": 1,
+    "usage": 1
+}
+
+def _image_digests(history: List[Dict]) -> List[str]:
+    return [
+        part["image_ref"]["sha256"]
+        for turn in history
+        for part in turn.get("parts", [])
+        if "image_ref" in part
+    ]
+
+
+def encode_cursor(session: Dict) -> str:
+    """Opaque keyset cursor pointing just after the given session in (updated_at, session_id) order."""
+    raw = json.dumps({"u": session["updated_at"].isoformat(), "s": session["session_id"]})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Inverse of encode_cursor. Raises ValueError on malformed input."""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(raw["u"]), raw["s"]
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
 
 class SessionService:
-    def __init__(self):
-        self.client = AsyncIOMotorClient(MONGO_URI)
+    def __init__(self, storage: str = SESSION_STORAGE, connect: bool = True):
+        """
+        With connect=False the MongoDB client is created later by connect(), e.g. in the app's
+        lifespan, so that importing the app opens no connections.
+        """
+        if storage not in ("embedded", "messages"):
+            raise ValueError(f"Unknown SESSION_STORAGE: {storage}")
+        self.storage = storage
+        self.client = None
+        # Bound to the database by connect(); shared with LLMService for hydrating images
+        self.blobs = BlobStore()
+        # Compressed history of idle sessions, whose documents keep only metadata and 'archived_at'
+        self.archive = SessionArchive()
+        if connect:
+            self.connect()
+
+    def connect(self, client=None):
+        """Creates the MongoDB client (with the configured pool settings) unless one is given."""
+        self.client = client or AsyncIOMotorClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS
+        )
         self.db = self.client.get_database("hymn-chat")
         self.collection = self.db.get_collection("sessions")
+        self.messages = self.db.get_collection("messages")
+        # Text of embedded-history turns, written once per turn, for search (see SessionSearch)
+        self.turn_text = self.db.get_collection("turn_text")
+        self.blobs.bind(self.db)
+        self.archive.bind(self.db)
+
+    async def ping(self):
+        """Round trip to the server: fails fast if MongoDB is unreachable and opens the first connection."""
+        await self.db.command("ping")
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
 
+    async def ensure_indexes(self):
+        """Creates the indexes the service relies on. Safe to call on every startup."""
+        await self.collection.create_index([("session_id", ASCENDING)], unique=True)
+        # Supports the per-user listing sorted by recency, including the session_id tie-breaker
+        await self.collection.create_index(
+            [("user_id", ASCENDING), ("updated_at", DESCENDING), ("session_id", DESCENDING)]
+        )
+        # Full scans in update order, for exports
+        await self.collection.create_index([("updated_at", ASCENDING), ("session_id", ASCENDING)])
+        await self.messages.create_index([("session_id", ASCENDING), ("seq", ASCENDING)], unique=True)
+        await self.turn_text.create_index([("session_id", ASCENDING), ("seq", ASCENDING)], unique=True)
+        await self.blobs.ensure_indexes()
+
+    async def backfill_message_counts(self, session_id: str = None):
+        """
+        Sets the stored message_count on sessions created before it was maintained, or only on
+        the given session. Scans the whole collection: run it as a migration (migrate_schema.py),
+        not at startup.
+        """
+        query = {"message_count": {"$exists": False}}
+        if session_id is not None:
+            query["session_id"] = session_id
+        await self.collection.update_many(
+            query,
+            [{"$set": {"message_count": {"$size": {"$ifNull": ["$history", []]}}}}]
+        )
+
+    @staticmethod
+    def new_session_id() -> str:
+        return str(uuid.uuid4())
+
+    @timed("mongo.create_session")
     async def create_session(self, user_id: str = None, title: str = None) -> str:
-        session_id = str(uuid.uuid4())
+        session_id = self.new_session_id()
         # Create empty session document
-        await self.collection.insert_one({
+        session = {
             "session_id": session_id,
             "user_id": user_id,
             "title": title or "New Chat",
             "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow(),
-            "history": []
-        })
+            "message_count": 0
+        }
+        if self.storage == "embedded":
+            session["history"] = []
+        await self.collection.insert_one(session)
         return session_id
 
-    async def get_history(self, session_id: str) -> List[Dict]:
-        doc = await self.collection.find_one({"session_id": session_id})
+    async def _load_messages(self, session_id: str, start_seq: int = 0, limit: int = None,
+                             end_seq: int = None) -> List[Dict]:
+        """
+        Turns of a session from the 'messages' collection with start_seq <= seq < end_seq
+        (or only the last 'limit' of them).
+        """
+        query = {"session_id": session_id}
+        if start_seq or end_seq is not None:
+            query["seq"] = {"$gte": start_seq}
+            if end_seq is not None:
+                query["seq"]["$lt"] = end_seq
+        if limit:
+            cursor = self.messages.find(query, MESSAGE_PROJECTION).sort("seq", DESCENDING).limit(limit)
+            turns = await cursor.to_list(length=limit)
+            turns.reverse()
+            return turns
+        return await self.messages.find(query, MESSAGE_PROJECTION).sort("seq", ASCENDING).to_list(length=None)
+
+    @timed("mongo.get_history")
+    async def get_history(self, session_id: str, limit: int = None) -> List[Dict]:
+        """Returns the session's turns, or only the last 'limit' of them."""
+        if self.storage == "messages":
+            doc = await self.collection.find_one(
+                {"session_id": session_id}, {"_id": 0, "session_id": 1, "history": 1, "archived_at": 1}
+            )
+            if doc and "history" not in doc and "archived_at" not in doc:
+                return await self._load_messages(session_id, limit=limit)
+        else:
+            projection = {"_id": 0, "history": {"$slice": -limit} if limit else 1, "archived_at": 1}
+            doc = await self.collection.find_one({"session_id": session_id}, projection)
+        if doc and "archived_at" in doc:
+            history = await self._archived_history(session_id)
+            return history[-limit:] if limit else history
         if doc and "history" in doc:
-            return doc["history"]
+            return doc["history"][-limit:] if limit else doc["history"]
         return []
     
+    @timed("mongo.get_history_page")
+    async def get_history_page(self, session_id: str, start: int = 0, count: int = None) -> List[Dict]:
+        """Returns 'count' turns (or all remaining) from index 'start' on, without loading the rest."""
+        if count == 0:
+            return []
+        history = {"$slice": [start, count]} if count is not None else {"$slice": [start, 2 ** 31 - 1]}
+        doc = await self.collection.find_one(
+            {"session_id": session_id}, {"_id": 0, "session_id": 1, "history": history, "archived_at": 1}
+        )
+        if not doc:
+            return []
+        if "archived_at" in doc:
+            archived = await self._archived_history(session_id)
+            return archived[start:start + count] if count is not None else archived[start:]
+        if "history" in doc:
+            return doc["history"]
+        if self.storage == "messages":
+            end = start + count if count is not None else None
+            return await self._load_messages(session_id, start_seq=start, end_seq=end)
+        return []
+
+    @timed("mongo.get_session_meta")
+    async def get_session_meta(self, session_id: str) -> Optional[Dict]:
+        """Session metadata (as in listings) without any history."""
+        return await self.collection.find_one({"session_id": session_id}, SESSION_LIST_PROJECTION)
+
+    @timed("mongo.get_context")
+    async def get_context(self, session_id: str) -> Tuple[List[Dict], Optional[Dict], int, int]:
+        """
+        Returns (history, summary, offset, history_tokens): what the LLM needs to continue a session.
+        With message storage only the turns not yet covered by the rolling summary are loaded;
+        'offset' is the index of the first returned turn in the full history. 'history_tokens' is
+        the token cost of the whole history, loaded or not (0 for sessions older than its tracking).
+        """
+        doc = await self.collection.find_one(
+            {"session_id": session_id},
+            {"_id": 0, "session_id": 1, "history": 1, "summary": 1, "archived_at": 1, "history_tokens": 1}
+        )
+        if not doc:
+            return [], None, 0, 0
+        summary = doc.get("summary")
+        history_tokens = doc.get("history_tokens", 0)
+        if "archived_at" in doc:
+            history = await self._archived_history(session_id)
+            offset = summary["through"] if summary and self.storage == "messages" else 0
+            return history[offset:], summary, offset, history_tokens
+        if self.storage == "messages" and "history" not in doc:
+            offset = summary["through"] if summary else 0
+            return await self._load_messages(session_id, start_seq=offset), summary, offset, history_tokens
+        return doc.get("history", []), summary, 0, history_tokens
+
+    @timed("mongo.get_session")
     async def get_session(self, session_id: str) -> Optional[Dict]:
-        return await self.collection.find_one({"session_id": session_id})
+        session = await self.collection.find_one({"session_id": session_id})
+        if session and "archived_at" in session:
+            session["history"] = await self._archived_history(session_id)
+        elif session and self.storage == "messages" and "history" not in session:
+            session["history"] = await self._load_messages(session_id)
+        return session
 
-    async def get_user_sessions(self, user_id: str) -> List[Dict]:
-        cursor = self.collection.find({"user_id": user_id}).sort("updated_at", -1)
-        sessions = await cursor.to_list(length=100)
-        return sessions
+    @timed("mongo.get_user_sessions")
+    async def get_user_sessions(self, user_id: str, limit: int = 100, cursor: str = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Lists a user's sessions, most recently updated first, without their history.
+        Returns (sessions, next_cursor); next_cursor is None on the last page.
+        """
+        query = {"user_id": user_id}
+        if cursor:
+            updated_at, session_id = decode_cursor(cursor)
+            query["$or"] = [
+                {"updated_at": {"$lt": updated_at}},
+                {"updated_at": updated_at, "session_id": {"$lt": session_id}}
+            ]
+
+        # Fetch one extra document to know whether another page exists
+        results = self.collection.find(query, SESSION_LIST_PROJECTION).sort(
+            [("updated_at", DESCENDING), ("session_id", DESCENDING)]
+        ).limit(limit + 1)
+        sessions = await results.to_list(length=limit + 1)
+
+        next_cursor = None
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_cursor = encode_cursor(sessions[-1])
+        return sessions, next_cursor
 
-    async def update_session_title(self, session_id: str, title: str):
-        """Update the session title."""
+    @timed("mongo.update_session_title")
+    async def update_session_title(self, session_id: str, title: str, only_if_untitled: bool = False):
+        """
+        Update the session title.
+        With only_if_untitled, the title is only written while it is still the default "New Chat",
+        so a late background write never overrides a title set in the meantime.
+        """
+        query = {"session_id": session_id}
+        if only_if_untitled:
+            query["title"] = "New Chat"
         await self.collection.update_one(
-            {"session_id": session_id},
+            query,
             {"$set": {"title": title, "updated_at": datetime.utcnow()}}
         )
 
+    @timed("mongo.delete_session")
     async def delete_session(self, session_id: str) -> bool:
         """Delete a session by its ID."""
         result = await self.collection.delete_one({"session_id": session_id})
+        await self.messages.delete_many({"session_id": session_id})
+        await self.turn_text.delete_many({"session_id": session_id})
+        await self.archive.delete(session_id)
+        await self.blobs.release(session_id)
         return result.deleted_count > 0
 
-    async def add_message(self, session_id: str, role: str, content: Any, image_data: bytes = None, mime_type: str = None):
-        """
-        Adds a message to the history. 
-        Content can be string literal or we can pass image_data to be stored as a structure.
-        Uses a format compatible with OpenAI's message structure.
-        """
+    async def _build_turn(self, session_id: str, role: str, content: Any, image_data: bytes = None,
+                          mime_type: str = None) -> Dict:
+        """Builds a stored history turn, moving any image bytes into the blob store."""
         # Map to standard roles (user/model for consistency)
         stored_role = "user" if role == "user" else "model"
         
         parts = []
         
-        # If there is image data, we persist it (Base64) so it can be restored contextually
+        # If there is image data, store the bytes once in the blob store and keep only a reference,
+        # so the session document does not grow with every upload
         if image_data and mime_type:
-            # Encode bytes to base64 string
-            b64_data = base64.b64encode(image_data).decode('utf-8')
-            parts.append({
-                "inline_data": {
-                    "mime_type": mime_type,
-                    "data": b64_data
-                }
-            })
+            parts.append({"image_ref": await self.blobs.put(image_data, mime_type, session_id)})
         
         # Add text content if present
         if content:
             parts.append({"text": str(content)})
         
-        new_turn = {
+        return {
             "role": stored_role,
             "parts": parts,
             "timestamp": datetime.utcnow().isoformat()
         }
-        
-        await self.collection.update_one(
-            {"session_id": session_id},
-            {
-                "$push": {"history": new_turn},
-                "$set": {"updated_at": datetime.utcnow()}
-            },
-            upsert=True
+
+    @timed("mongo.append_exchange")
+    async def append_exchange(self, session_id: str, user_id: str, message: str, response_text: str,
+                              image_data: bytes = None, mime_type: str = None, summary: Dict = None,
+                              usage: Dict[str, int] = None, truncated: bool = False) -> Dict:
+        """
+        Appends a user/model exchange in a single round trip, creating the session if it does not exist.
+        An updated rolling summary of older turns, if given, is saved in the same update, and the
+        exchange's token usage (prompt/completion/cached tokens) is added to the session's 'usage'.
+        A response cut short (the client went away, the stream failed) is stored with 'truncated': True,
+        as an empty model turn if no text had been generated, so the question never goes unanswered.
+        Returns the post-update session metadata ('title' and 'message_count') for the title decision.
+        """
+        turns = [await self._build_turn(session_id, "user", message, image_data, mime_type)]
+        if response_text or truncated:
+            turns.append(await self._build_turn(session_id, "model", response_text))
+            if truncated:
+                turns[-1]["truncated"] = True
+
+        return await self._append_turns(session_id, user_id, turns, summary, usage)
+
+    async def _append_turns(self, session_id: str, user_id: Optional[str], turns: List[Dict],
+                            summary: Dict = None, usage: Dict[str, int] = None) -> Dict:
+        """Stores turns at the end of the session's history, creating the session if needed."""
+        for turn in turns:
+            STORED_DOCUMENT_SIZE.labels("history_turn").observe(len(bson.encode(turn)))
+
+        now = datetime.utcnow()
+        fields = {"updated_at": now}
+        if summary:
+            fields["summary"] = summary
+        # history_tokens keeps the cost of replaying the whole conversation without loading it
+        counters = {"message_count": len(turns), "history_tokens": sum(turn_tokens(turn) for turn in turns)}
+        for name, count in (usage or {}).items():
+            counters[f"usage.{name}"] = count
+        update = {
+            "$inc": counters,
+            "$set": fields,
+            "$setOnInsert": {"user_id": user_id, "title": "New Chat", "created_at": now}
+        }
+
+        if self.storage == "embedded":
+            update["$push"] = {"history": {"$each": turns}}
+            session = await self._update_session(
+                session_id, update, {"_id": 0, "title": 1, "message_count": 1, "user_id": 1, "archived_at": 1}
+            )
+            user_id = session.pop("user_id", None)
+            await self._index_turn_text(session_id, user_id, turns, session["message_count"] - len(turns))
+            archived_at = session.pop("archived_at", None)
+            if archived_at is not None:
+                await self._restore(session_id, user_id, archived_at)
+            return session
+
+        # message_count doubles as the sequence allocator: the $inc reserves this exchange's seqs
+        session = await self._update_session(
+            session_id, update, {"_id": 0, "title": 1, "message_count": 1, "user_id": 1, "history": 1, "archived_at": 1}
         )
-    
-    async def should_generate_title(self, session_id: str) -> bool:
-        """Check if we should generate a title (after first exchange)."""
-        session = await self.get_session(session_id)
-        if session:
-            # Generate title if it's still "New Chat" and we have at least 2 messages (user + model)
-            history = session.get("history", [])
-            return session.get("title") == "New Chat" and len(history) >= 2
-        return False
+        legacy_history = session.pop("history", None)
+        if legacy_history is not None:
+            await self._migrate_history(session_id, session.get("user_id"), legacy_history)
+        archived_at = session.pop("archived_at", None)
+        if archived_at is not None:
+            await self._restore(session_id, session.get("user_id"), archived_at)
+        first_seq = session["message_count"] - len(turns)
+        await self.messages.insert_many([
+            {"session_id": session_id, "seq": first_seq + i, "user_id": session.get("user_id"), **turn}
+            for i, turn in enumerate(turns)
+        ])
+        return session
+
+    async def _update_session(self, session_id: str, update: Dict, projection: Dict) -> Dict:
+        """
+        Applies an append's update, creating the session if needed, and returns it as updated.
+        Only sessions with a stored message_count match: the $inc on it allocates the new turns'
+        positions, which a missing count would restart from 0.
+        """
+        query = {"session_id": session_id, "message_count": {"$exists": True}}
+        try:
+            return await self.collection.find_one_and_update(
+                query, update, projection=projection, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The session exists without a count (migrate_schema.py has not run yet), or a
+            # concurrent append created it first: count its history, then apply the update
+            await self.backfill_message_counts(session_id)
+            return await self.collection.find_one_and_update(
+                query, update, projection=projection, upsert=True, return_document=ReturnDocument.AFTER
+            )
+
+    async def _insert_messages(self, session_id: str, user_id: Optional[str], history: List[Dict]):
+        """Copies a full history into 'messages' as seq 0.., skipping turns that are already there."""
+        if not history:
+            return
+        try:
+            await self.messages.insert_many([
+                {"session_id": session_id, "seq": seq, "user_id": user_id, **turn}
+                for seq, turn in enumerate(history)
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Turns already copied by an earlier, interrupted attempt are fine
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def _index_turn_text(self, session_id: str, user_id: Optional[str], turns: List[Dict], first_seq: int = 0):
+        """
+        Stores the text of embedded turns in 'turn_text' as seq first_seq.., skipping turns that are
+        already there. Search indexes these small write-once documents instead of the session
+        document, which would be re-tokenized in full on every append.
+        """
+        docs = []
+        for seq, turn in enumerate(turns, first_seq):
+            text = " ".join(part["text"] for part in turn.get("parts", []) if part.get("text"))
+            if text:
+                docs.append({"session_id": session_id, "seq": seq, "user_id": user_id, "text": text})
+        if not docs:
+            return
+        try:
+            await self.turn_text.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def index_turn_text(self, batch_size: int = 100) -> int:
+        """
+        Fills 'turn_text' for embedded histories written before it was maintained. Idempotent and
+        safe to run while serving; run it as a migration (migrate_schema.py). Returns the number
+        of sessions scanned.
+        """
+        scanned = 0
+        cursor = self.collection.find(
+            {"history": {"$exists": True}},
+            {"_id": 0, "session_id": 1, "user_id": 1, "history.parts.text": 1}
+        ).batch_size(batch_size)
+        async for session in cursor:
+            await self._index_turn_text(session["session_id"], session.get("user_id"), session["history"])
+            scanned += 1
+        return scanned
+
+    async def _migrate_history(self, session_id: str, user_id: Optional[str], history: List[Dict]):
+        """Copies an embedded history into 'messages', then drops it from the session document."""
+        await self._insert_messages(session_id, user_id, history)
+        # Only drop the array if nothing was pushed to it meanwhile (e.g. by a not yet upgraded worker)
+        result = await self.collection.update_one(
+            {"session_id": session_id, "history": {"$size": len(history)}},
+            {"$unset": {"history": ""}}
+        )
+        if result.modified_count:
+            # The 'messages' text index covers these turns now
+            await self.turn_text.delete_many({"session_id": session_id})
+
+    async def migrate_to_messages(self, batch_size: int = 100) -> int:
+        """
+        Moves every embedded history into the 'messages' collection. Idempotent and safe to run
+        while serving; returns the number of sessions migrated.
+        """
+        await self.backfill_message_counts()
+        migrated = 0
+        cursor = self.collection.find(
+            {"history": {"$exists": True}}, {"_id": 0, "session_id": 1, "user_id": 1, "history": 1}
+        ).batch_size(batch_size)
+        async for session in cursor:
+            await self._migrate_history(session["session_id"], session.get("user_id"), session["history"])
+            migrated += 1
+        return migrated
+
+    async def backfill_blob_refs(self, batch_size: int = 100) -> int:
+        """
+        Records the sessions referencing each blob, for blobs stored before references were
+        tracked: embedded histories, 'messages' and archives are all scanned. Idempotent; run it
+        as a migration (migrate_schema.py). Returns the number of sessions with images.
+        """
+        sessions = set()
+
+        async def add_refs(session_id: str, history: List[Dict]):
+            digests = _image_digests(history)
+            if digests:
+                await self.blobs.add_refs(digests, session_id)
+                sessions.add(session_id)
+
+        cursor = self.collection.find(
+            {"history.parts.image_ref": {"$exists": True}},
+            {"_id": 0, "session_id": 1, "history.parts.image_ref.sha256": 1}
+        ).batch_size(batch_size)
+        async for session in cursor:
+            await add_refs(session["session_id"], session["history"])
+        cursor = self.messages.find(
+            {"parts.image_ref": {"$exists": True}}, {"_id": 0, "session_id": 1, "parts.image_ref.sha256": 1}
+        ).batch_size(batch_size)
+        async for turn in cursor:
+            await add_refs(turn["session_id"], [turn])
+        cursor = self.collection.find({"archived_at": {"$exists": True}}, {"_id": 0, "session_id": 1}).batch_size(batch_size)
+        async for session in cursor:
+            await add_refs(session["session_id"], await self.archive.get(session["session_id"]) or [])
+        return len(sessions)
+
+    async def _archived_history(self, session_id: str) -> List[Dict]:
+        # None if a concurrent append restored the session since its document was read
+        return await self.archive.get(session_id) or []
+
+    async def _restore(self, session_id: str, user_id: Optional[str], archived_at: datetime):
+        """
+        Moves an archived history back in front of the turns just appended, so the session is
+        stored like any other again. Concurrent appends may all try; only one restores.
+        """
+        history = await self.archive.get(session_id)
+        if history is None:
+            return
+        stub = {"session_id": session_id, "archived_at": archived_at}
+        if self.storage == "embedded":
+            result = await self.collection.update_one(stub, {
+                "$push": {"history": {"$each": history, "$position": 0}},
+                "$unset": {"archived_at": ""}
+            })
+            if result.modified_count:
+                await self._index_turn_text(session_id, user_id, history)
+        else:
+            # Archived turns keep their seqs: the message_count on the stub kept allocating after them
+            await self._insert_messages(session_id, user_id, history)
+            result = await self.collection.update_one(stub, {"$unset": {"archived_at": ""}})
+            if result.modified_count:
+                # The 'messages' text index covers the restored turns again
+                await self.turn_text.delete_many({"session_id": session_id})
+        if result.modified_count:
+            await self.archive.delete(session_id)
+
+    async def _archive_session(self, session: Dict, dry_run: bool) -> Optional[Dict]:
+        """
+        Moves one session's history to the archive and leaves its metadata behind. The turns'
+        text stays searchable in 'turn_text' (copied there from 'messages' with message storage).
+        Returns the turns archived and bytes moved, or None if there was nothing to archive
+        or the session was written to meanwhile.
+        """
+        session_id = session["session_id"]
+        if "history" in session:
+            history = session["history"]
+            hot_bytes = len(bson.encode({"history": history}))
+            last_seq = None
+        else:
+            docs = await self.messages.find({"session_id": session_id}).sort("seq", ASCENDING).to_list(length=None)
+            history = [{k: v for k, v in doc.items() if MESSAGE_PROJECTION.get(k)} for doc in docs]
+            hot_bytes = sum(len(bson.encode(doc)) for doc in docs)
+            last_seq = docs[-1]["seq"] if docs else None
+        if not history:
+            return None
+        if dry_run:
+            return {"turns": len(history), "hot_bytes": hot_bytes, "archive_bytes": len(self.archive.pack(history))}
+
+        archive_bytes = await self.archive.put(session_id, session.get("user_id"), history)
+        # Only if nothing was appended since the history was read
+        result = await self.collection.update_one(
+            {"session_id": session_id, "updated_at": session["updated_at"], "archived_at": {"$exists": False}},
+            {"$set": {"archived_at": datetime.utcnow()}, "$unset": {"history": ""}}
+        )
+        if not result.modified_count:
+            await self.archive.delete(session_id)
+            return None
+        if last_seq is not None:
+            await self._index_turn_text(session_id, session.get("user_id"), history, docs[0]["seq"])
+            await self.messages.delete_many({"session_id": session_id, "seq": {"$lte": last_seq}})
+            # An append may have restored the turns between the stub update and the delete
+            if not await self.collection.find_one({"session_id": session_id, "archived_at": {"$exists": True}}, {"_id": 1}):
+                await self._insert_messages(session_id, session.get("user_id"), history)
+                await self.turn_text.delete_many({"session_id": session_id})
+        return {"turns": len(history), "hot_bytes": hot_bytes, "archive_bytes": archive_bytes}
+
+    async def archive_idle_sessions(self, idle_days: float = SESSION_ARCHIVE_AFTER_DAYS, batch_size: int = 100,
+                                    limit: int = None, dry_run: bool = False) -> Dict:
+        """
+        Archives the history of sessions not updated for idle_days, oldest first, up to 'limit'
+        sessions. Safe to run while serving, one run at a time. Returns a report of sessions and
+        turns archived and bytes removed from the hot collections ('hot_bytes') versus stored in
+        the archive ('archive_bytes'); with dry_run nothing is written.
+        """
+        cutoff = datetime.utcnow() - timedelta(days=idle_days)
+        report = {"sessions": 0, "turns": 0, "hot_bytes": 0, "archive_bytes": 0, "skipped": 0}
+        cursor = self.collection.find(
+            {"updated_at": {"$lt": cutoff}, "archived_at": {"$exists": False}},
+            {"_id": 0, "session_id": 1, "user_id": 1, "updated_at": 1, "history": 1}
+        ).sort([("updated_at", ASCENDING), ("session_id", ASCENDING)]).batch_size(batch_size)
+        async for session in cursor:
+            if limit is not None and report["sessions"] >= limit:
+                break
+            archived = await self._archive_session(session, dry_run)
+            if archived is None:
+                report["skipped"] += 1
+                continue
+            report["sessions"] += 1
+            for name, value in archived.items():
+                report[name] += value
+        report["reclaimed_bytes"] = report["hot_bytes"] - report["archive_bytes"]
+        return report
+
+    @staticmethod
+    def needs_title(session: Dict) -> bool:
+        """Generate a title if it's still "New Chat" and we have at least 2 messages (user + model)."""
+        return session.get("title") == "New Chat" and session.get("message_count", 0) >= 2
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional, Set, Tuple
+from services.metrics import TITLE_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+TITLE_QUEUE_SIZE = int(os.getenv("TITLE_QUEUE_SIZE", "1000"))
+TITLE_BATCH_SIZE = int(os.getenv("TITLE_BATCH_SIZE", "8"))
+TITLE_DRAIN_TIMEOUT = float(os.getenv("TITLE_DRAIN_TIMEOUT", "10"))
+
+# (session_id, user_message, ai_response)
+TitleJob = Tuple[str, str, str]
+
+
+class TitleWorker:
+    """
+    Generates session titles in the background so chat responses do not wait for them.
+    Jobs are fed through a bounded asyncio queue; whatever is pending when the worker
+    wakes up is batched into a single LLM call.
+    """
+
+    def __init__(self, llm_service, session_service, max_queue: int = TITLE_QUEUE_SIZE,
+                 batch_size: int = TITLE_BATCH_SIZE):
+        self.llm_service = llm_service
+        self.session_service = session_service
+        self.batch_size = batch_size
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: List[TitleJob] = []
+        # Sessions with a queued or in-flight job; follow-up turns must not queue another one
+        self._pending: Set[str] = set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, session_id: str, user_message: str, ai_response: str) -> bool:
+        """Queues a title job. Returns False if the queue is full."""
+        if session_id in self._pending:
+            return True
+        try:
+            self.queue.put_nowait((session_id, user_message, ai_response))
+            self._pending.add(session_id)
+            TITLE_QUEUE_DEPTH.set(self.queue.qsize())
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def stop(self, timeout: float = TITLE_DRAIN_TIMEOUT):
+        """Drains pending jobs, then stops the worker. Jobs left after the timeout get fallback titles."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Title queue not drained after %.1fs; writing fallback titles", timeout)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        # Jobs interrupted mid-batch plus anything still queued
+        leftover = self._in_flight
+        self._in_flight = []
+        while not self.queue.empty():
+            leftover.append(self.queue.get_nowait())
+            self.queue.task_done()
+        self._pending.clear()
+        await self._write_titles(leftover, [self.llm_service.fallback_title(m) for _, m, _ in leftover])
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            TITLE_QUEUE_DEPTH.set(self.queue.qsize())
+            self._in_flight = batch
+            try:
+                titles = await self.llm_service.generate_titles([(m, r) for _, m, r in batch])
+                await self._write_titles(batch, titles)
+            except Exception:
+                logger.exception("Failed to generate titles for %d sessions", len(batch))
+            self._in_flight = []
+            self._pending.difference_update(session_id for session_id, _, _ in batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _write_titles(self, jobs: List[TitleJob], titles: List[str]):
+        await asyncio.gather(*(
+            self.session_service.update_session_title(session_id, title, only_if_untitled=True)
+            for (session_id, _, _), title in zip(jobs, titles)
+        ))
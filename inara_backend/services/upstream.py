@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import AsyncIterator, Dict, Optional
+import openai
+from services.metrics import LLM_CALLS_CANCELLED, LLM_CALLS_IN_FLIGHT, LLM_CALLS_WAITING
+
+logger = logging.getLogger(__name__)
+
+# Maximum concurrent in-flight calls to the LLM provider from this worker
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+# How long a call may wait for a free slot before failing fast
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+# Deadline per attempt; for streams, for the first chunk and then between chunks
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Consecutive failed calls that open the circuit, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Failures worth retrying: rate limits, provider-side errors and transport problems
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,  # includes APITimeoutError
+    asyncio.TimeoutError,
+)
+
+
+class UpstreamUnavailable(Exception):
+    """The LLM provider is unhealthy or saturated; callers should answer 503."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Opens after a run of consecutive failures and rejects calls until reset_timeout has passed.
+    Then a single trial call is let through (half-open): success closes the circuit, failure reopens it.
+    Results are reported with the generation (opened_count) the call was admitted in: a call that
+    started before the circuit last opened says nothing about the provider's recovery and is ignored.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_count = 0
+        self._trial_in_flight = False
+
+    def retry_after(self) -> float:
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def available(self) -> bool:
+        """Whether a call would currently be let through (does not claim the half-open trial)."""
+        if self.state == self.OPEN:
+            return self.retry_after() <= 0
+        if self.state == self.HALF_OPEN:
+            return not self._trial_in_flight
+        return True
+
+    @property
+    def generation(self) -> int:
+        return self.opened_count
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and self.retry_after() <= 0:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+        return self.state == self.CLOSED
+
+    def release_trial(self, generation: int):
+        if generation == self.opened_count:
+            self._trial_in_flight = False
+
+    def record_success(self, generation: int):
+        if generation != self.opened_count:
+            return
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self, generation: int):
+        if generation != self.opened_count:
+            return
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened_count += 1
+                logger.warning("LLM circuit opened after %d consecutive failures", self.failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+def _retry_after_header(error: Exception) -> Optional[float]:
+    """Seconds requested by the provider's retry-after header, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if value:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return None
+
+
+class UpstreamClient:
+    """
+    Guards calls to chat.completions: bounded concurrency, per-attempt deadlines, jittered retries
+    that honour 429 retry-after, and a circuit breaker that fails fast while the provider is unhealthy.
+    """
+
+    def __init__(self, client: openai.AsyncOpenAI = None, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, timeout: float = LLM_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES, breaker: CircuitBreaker = None):
+        self.client = None
+        if client is not None:
+            self.bind(client)
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.counters: Dict[str, int] = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "rate_limited": 0,
+            "rejected_circuit_open": 0,
+            "rejected_saturated": 0,
+            "cancelled": 0,
+        }
+
+    def bind(self, client: openai.AsyncOpenAI):
+        # Retries are handled here, not by the SDK; the copy shares the client's connection pool
+        self.client = client.with_options(max_retries=0)
+
+    def ensure_available(self):
+        """Raises UpstreamUnavailable while the circuit is open, so callers can fail before doing any work."""
+        if not self.breaker.available():
+            self.counters["rejected_circuit_open"] += 1
+            raise UpstreamUnavailable("LLM provider unavailable", retry_after=self.breaker.retry_after())
+
+    async def _acquire(self):
+        """Claims a concurrency slot, failing fast if none frees up within queue_timeout."""
+        self.waiting += 1
+        LLM_CALLS_WAITING.inc()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counters["rejected_saturated"] += 1
+            raise UpstreamUnavailable("LLM capacity exhausted", retry_after=1.0)
+        finally:
+            self.waiting -= 1
+            LLM_CALLS_WAITING.dec()
+        self.in_flight += 1
+        LLM_CALLS_IN_FLIGHT.inc()
+
+    def _release(self):
+        self.in_flight -= 1
+        LLM_CALLS_IN_FLIGHT.dec()
+        self._semaphore.release()
+
+    def _cancelled(self):
+        self.counters["cancelled"] += 1
+        LLM_CALLS_CANCELLED.inc()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+        retry_after = _retry_after_header(error)
+        if retry_after is not None:
+            # Never retry sooner than the provider asked; jitter on top spreads the herd
+            delay = retry_after + random.uniform(0, LLM_RETRY_BASE_DELAY)
+        return delay
+
+    async def _call(self, attempt_fn):
+        """Runs attempt_fn (one guarded attempt) under the circuit breaker, retrying transient failures."""
+        self.counters["calls"] += 1
+        if not self.breaker.allow():
+            self.counters["rejected_circuit_open"] += 1
+            raise UpstreamUnavailable("LLM provider unavailable", retry_after=self.breaker.retry_after())
+        generation = self.breaker.generation
+
+        attempt = 0
+        try:
+            while True:
+                try:
+                    result = await attempt_fn()
+                    self.breaker.record_success(generation)
+                    self.counters["successes"] += 1
+                    return result
+                except RETRYABLE_ERRORS as e:
+                    if isinstance(e, asyncio.TimeoutError):
+                        self.counters["timeouts"] += 1
+                    elif isinstance(e, openai.RateLimitError):
+                        self.counters["rate_limited"] += 1
+                    delay = self._backoff(attempt, e)
+                    # Give up when out of attempts or when the provider asks us to wait too long
+                    if attempt >= self.max_retries or delay > 2 * LLM_RETRY_MAX_DELAY:
+                        self.counters["failures"] += 1
+                        self.breaker.record_failure(generation)
+                        raise UpstreamUnavailable(
+                            f"LLM provider failed: {type(e).__name__}",
+                            retry_after=_retry_after_header(e)
+                        ) from e
+                    self.counters["retries"] += 1
+                    attempt += 1
+                    await asyncio.sleep(delay)
+                except UpstreamUnavailable:
+                    # Saturated locally; says nothing about the provider
+                    raise
+                except asyncio.CancelledError:
+                    # Abandoned by the caller; the provider request is aborted with it
+                    self._cancelled()
+                    raise
+                except Exception:
+                    # Client-side errors (bad request, auth) mean the provider answered
+                    self.counters["failures"] += 1
+                    self.breaker.record_success(generation)
+                    raise
+        finally:
+            # Free the half-open trial if the call ended without a verdict (saturation, cancellation)
+            self.breaker.release_trial(generation)
+
+    async def create(self, **kwargs):
+        """Guarded, non-streaming chat.completions.create."""
+        async def attempt():
+            await self._acquire()
+            try:
+                return await asyncio.wait_for(self.client.chat.completions.create(**kwargs), self.timeout)
+            finally:
+                self._release()
+        return await self._call(attempt)
+
+    async def stream(self, **kwargs) -> AsyncIterator:
+        """
+        Guarded streaming chat.completions.create, yielding chunks.
+        Retries only happen before the first chunk; the concurrency slot is held until the stream ends.
+        """
+        async def attempt():
+            await self._acquire()
+            try:
+                stream = await asyncio.wait_for(
+                    self.client.chat.completions.create(stream=True, **kwargs), self.timeout
+                )
+                iterator = stream.__aiter__()
+                try:
+                    first = await asyncio.wait_for(iterator.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    first = None
+                except BaseException:
+                    await stream.close()
+                    raise
+                return stream, iterator, first
+            except BaseException:
+                self._release()
+                raise
+
+        stream, iterator, first = await self._call(attempt)
+        try:
+            if first is None:
+                return
+            yield first
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        except asyncio.TimeoutError as e:
+            self.counters["timeouts"] += 1
+            raise UpstreamUnavailable("LLM stream stalled") from e
+        except (asyncio.CancelledError, GeneratorExit):
+            # Cancelled, or closed by a consumer that stopped reading
+            self._cancelled()
+            raise
+        finally:
+            # Release the upstream connection, also when the consumer stops early
+            self._release()
+            await stream.close()
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "circuit_state": self.breaker.state,
+            "circuit_opened": self.breaker.opened_count,
+        }
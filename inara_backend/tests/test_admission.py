@@ -0,0 +1,116 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import services.session_service  # noqa: E402
+from bench.memory_mongo import MemoryMongoClient  # noqa: E402
+
+# Must happen before the routes (and with them SessionService) are imported
+services.session_service.AsyncIOMotorClient = MemoryMongoClient
+
+import api.routes as routes  # noqa: E402
+from main import app  # noqa: E402
+from services.admission import AdmissionController, AdmissionRejected, FairScheduler  # noqa: E402
+from services.idempotency import IdempotentRequests  # noqa: E402
+
+
+async def grant_order(scheduler: FairScheduler, waiters):
+    """Queues (key, name) waiters behind a held slot, then releases one slot at a time."""
+    granted = []
+
+    async def wait(key, name):
+        await scheduler.acquire(key, timeout=5)
+        granted.append(name)
+
+    await scheduler.acquire("holder", timeout=5)
+    tasks = []
+    for key, name in waiters:
+        tasks.append(asyncio.create_task(wait(key, name)))
+        await asyncio.sleep(0)
+    for _ in waiters:
+        scheduler.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return granted
+
+
+def test_slots_go_round_robin_across_users():
+    scheduler = FairScheduler(slots=1)
+    waiters = [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("c", "c1"), ("b", "b2")]
+    assert asyncio.run(grant_order(scheduler, waiters)) == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_weights_grant_several_per_turn():
+    scheduler = FairScheduler(slots=1, weights={"a": 2})
+    waiters = [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("b", "b2"), ("c", "c1")]
+    assert asyncio.run(grant_order(scheduler, waiters)) == ["a1", "a2", "b1", "c1", "a3", "b2"]
+
+
+def test_timed_out_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = FairScheduler(slots=1)
+        await scheduler.acquire("holder", timeout=1)
+        with pytest.raises(asyncio.TimeoutError):
+            await scheduler.acquire("a", timeout=0.01)
+        assert scheduler.queued == 0 and scheduler.queued_for("a") == 0
+        scheduler.release()
+        assert scheduler.active == 0
+        await scheduler.acquire("b", timeout=0.01)
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_rejects_past_the_burst():
+    async def scenario():
+        admission = AdmissionController(enabled=True, rate_per_minute=1, burst=2, max_concurrency=1)
+        await admission.check("u")
+        await admission.check("u")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.check("u")
+        assert rejected.value.reason == "rate_limited"
+        assert rejected.value.retry_after > 0
+        await admission.check("other")
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def chat_app(monkeypatch):
+    """The app with a one-request burst and the LLM exchange replaced by a canned answer."""
+    calls = []
+
+    async def fake_chat(message, session_id, user_id, image_data, mime_type, no_cache, admission_key, request=None):
+        calls.append(message)
+        return {"response": f"answer to {message}", "session_id": session_id or "s1",
+                "context_tokens_saved": 0, "cached": False}
+
+    monkeypatch.setattr(routes, "_chat", fake_chat)
+    monkeypatch.setattr(routes, "admission", AdmissionController(enabled=True, rate_per_minute=1, burst=1))
+    monkeypatch.setattr(routes, "idempotent_requests", IdempotentRequests())
+    return calls
+
+
+def test_replay_does_not_use_a_rate_limit_token(chat_app):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            def send(key):
+                return client.post("/api/chat", data={"message": "dose?", "user_id": "u"},
+                                   headers={"Idempotency-Key": key})
+
+            first = await send("k1")
+            assert first.status_code == 200
+            # The bucket is empty now: a replay is still answered, a new request is not
+            for _ in range(3):
+                replay = await send("k1")
+                assert replay.status_code == 200
+                assert replay.headers["Idempotent-Replayed"] == "true"
+                assert replay.json() == first.json()
+            assert (await send("k2")).status_code == 429
+
+    asyncio.run(scenario())
+    assert chat_app == ["dose?"]
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from services.upstream import CircuitBreaker, UpstreamClient, UpstreamUnavailable
+
+
+def open_breaker(breaker: CircuitBreaker):
+    generation = breaker.generation
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow()
+        breaker.record_failure(generation)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    generation = breaker.generation
+    breaker.record_failure(generation)
+    breaker.record_failure(generation)
+    breaker.record_success(generation)
+    breaker.record_failure(generation)
+    breaker.record_failure(generation)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure(generation)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() > 0
+
+
+def test_success_of_call_admitted_before_opening_is_ignored():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    slow_call = breaker.generation
+    assert breaker.allow()
+    open_breaker(breaker)
+    breaker.record_success(slow_call)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_failure_of_call_admitted_before_opening_does_not_reopen():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    slow_call = breaker.generation
+    open_breaker(breaker)
+    assert breaker.allow()  # half-open trial
+    trial = breaker.generation
+    breaker.record_failure(slow_call)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_success(trial)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.opened_count == 1
+
+
+def test_half_open_lets_a_single_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    open_breaker(breaker)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.available()
+    assert not breaker.allow()
+    breaker.record_success(breaker.generation)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_trial_reopens():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0)
+    open_breaker(breaker)
+    assert breaker.allow()
+    breaker.record_failure(breaker.generation)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened_count == 2
+
+
+def test_trial_released_without_verdict_frees_the_slot():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    open_breaker(breaker)
+    assert breaker.allow()
+    breaker.release_trial(breaker.generation)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def test_stale_release_does_not_free_current_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    slow_call = breaker.generation
+    open_breaker(breaker)
+    assert breaker.allow()
+    breaker.release_trial(slow_call)
+    assert not breaker.allow()
+
+
+def test_client_ignores_slow_success_after_circuit_opened():
+    async def scenario():
+        upstream = UpstreamClient(max_retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        release_slow = asyncio.Event()
+
+        async def slow():
+            await release_slow.wait()
+            return "late answer"
+
+        async def failing():
+            raise asyncio.TimeoutError()
+
+        slow_call = asyncio.create_task(upstream._call(slow))
+        await asyncio.sleep(0)
+        for _ in range(2):
+            with pytest.raises(UpstreamUnavailable):
+                await upstream._call(failing)
+        assert upstream.breaker.state == CircuitBreaker.OPEN
+
+        release_slow.set()
+        assert await slow_call == "late answer"
+        assert upstream.breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(UpstreamUnavailable):
+            await upstream._call(slow)
+
+    asyncio.run(scenario())
@@ -36,7 +36,7 @@ class ChatSessionModel {
         if (parts != null) {
           for (var part in parts) {
             if (part is Map<String, dynamic>) {
-              // Skip inline_data for now (images from history)
+              // Skip image parts for now (inline_data / image_placeholder)
               if (part.containsKey('text')) {
                 messages.add(ChatMessageModel(
                   id: '${json['session_id']}_${messages.length}',
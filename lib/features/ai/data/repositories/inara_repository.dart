@@ -82,11 +82,13 @@ class InaraRepository {
     required String message,
     String? sessionId,
     String? userId,
+    String? idempotencyKey,
   }) async {
     final result = await _apiService.sendMessage(
       message: message,
       sessionId: sessionId,
       userId: userId,
+      idempotencyKey: idempotencyKey,
     );
 
     if (result.isSuccess && result.data != null) {
@@ -103,6 +105,7 @@ class InaraRepository {
     required String fileName,
     String? sessionId,
     String? userId,
+    String? idempotencyKey,
   }) async {
     final result = await _apiService.sendMessageWithImage(
       message: message,
@@ -110,6 +113,7 @@ class InaraRepository {
       fileName: fileName,
       sessionId: sessionId,
       userId: userId,
+      idempotencyKey: idempotencyKey,
     );
 
     if (result.isSuccess && result.data != null) {
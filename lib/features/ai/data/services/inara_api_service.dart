@@ -40,9 +40,18 @@ class ChatApiResponse {
   }
 }
 
+/// Last response for a session, revalidated with its ETag
+class _CachedSession {
+  final String etag;
+  final ChatSessionModel session;
+
+  _CachedSession(this.etag, this.session);
+}
+
 class InaraApiService {
   final String baseUrl;
   final http.Client _client;
+  final Map<String, _CachedSession> _sessionCache = {};
 
   InaraApiService({
     String? baseUrl,
@@ -84,19 +93,34 @@ class InaraApiService {
     }
   }
 
-  /// Get a specific session with full history
+  /// Get a specific session with full history.
+  /// Images come back as placeholders (the model only keeps text), and a session
+  /// fetched before is revalidated with If-None-Match: unchanged, it costs a 304.
   Future<ApiResult<ChatSessionModel>> getSession(String sessionId) async {
     try {
+      final cached = _sessionCache[sessionId];
       final response = await _client
           .get(
-            Uri.parse('$baseUrl${AppConfig.inaraSessionsEndpoint}/$sessionId'),
+            Uri.parse('$baseUrl${AppConfig.inaraSessionsEndpoint}/$sessionId')
+                .replace(queryParameters: {'images': 'placeholder'}),
+            headers: {
+              if (cached != null) 'If-None-Match': cached.etag,
+            },
           )
           .timeout(_timeout);
 
-      if (response.statusCode == 200) {
+      if (response.statusCode == 304 && cached != null) {
+        return ApiResult.success(cached.session);
+      } else if (response.statusCode == 200) {
         final json = jsonDecode(response.body);
-        return ApiResult.success(ChatSessionModel.fromJson(json));
+        final session = ChatSessionModel.fromJson(json);
+        final etag = response.headers['etag'];
+        if (etag != null) {
+          _sessionCache[sessionId] = _CachedSession(etag, session);
+        }
+        return ApiResult.success(session);
       } else if (response.statusCode == 404) {
+        _sessionCache.remove(sessionId);
         return ApiResult.failure('Session not found');
       } else {
         return ApiResult.failure(
@@ -147,6 +171,7 @@ class InaraApiService {
           )
           .timeout(_timeout);
 
+      _sessionCache.remove(sessionId);
       if (response.statusCode == 200) {
         return ApiResult.success(true);
       } else if (response.statusCode == 404) {
@@ -162,11 +187,13 @@ class InaraApiService {
     }
   }
 
-  /// Send a chat message (text only)
+  /// Send a chat message (text only).
+  /// Resending with the same [idempotencyKey] returns the original answer instead of asking again.
   Future<ApiResult<ChatApiResponse>> sendMessage({
     required String message,
     String? sessionId,
     String? userId,
+    String? idempotencyKey,
   }) async {
     try {
       final request = http.MultipartRequest(
@@ -181,6 +208,9 @@ class InaraApiService {
       if (userId != null) {
         request.fields['user_id'] = userId;
       }
+      if (idempotencyKey != null) {
+        request.headers['Idempotency-Key'] = idempotencyKey;
+      }
 
       final streamedResponse = await request.send().timeout(_timeout);
       final response = await http.Response.fromStream(streamedResponse);
@@ -208,6 +238,7 @@ class InaraApiService {
     required String fileName,
     String? sessionId,
     String? userId,
+    String? idempotencyKey,
   }) async {
     try {
       final request = http.MultipartRequest(
@@ -222,6 +253,9 @@ class InaraApiService {
       if (userId != null) {
         request.fields['user_id'] = userId;
       }
+      if (idempotencyKey != null) {
+        request.headers['Idempotency-Key'] = idempotencyKey;
+      }
 
       // Add image file from bytes (works on both web and mobile)
       final mimeType = _getMimeType(fileName);
@@ -5,6 +5,7 @@ library;
 
 import 'dart:typed_data';
 import 'package:flutter_riverpod/flutter_riverpod.dart';
+import 'package:uuid/uuid.dart';
 import '../../data/models/chat_message_model.dart';
 import '../../data/models/chat_session_model.dart';
 import '../../data/repositories/inara_repository.dart';
@@ -74,6 +75,11 @@ class ChatState {
 class ChatNotifier extends Notifier<ChatState> {
   late final InaraRepository _repository;
 
+  // Idempotency key of the last send that failed (e.g. timed out), reused when the
+  // same message is sent again so the backend answers and stores it only once
+  String? _failedKey;
+  String? _failedRequest;
+
   @override
   ChatState build() {
     _repository = ref.watch(inaraRepositoryProvider);
@@ -88,9 +94,22 @@ class ChatNotifier extends Notifier<ChatState> {
 
   /// Start a new chat (clears current state)
   void startNewChat() {
+    _failedKey = null;
     state = const ChatState();
   }
 
+  /// Idempotency key for a send: the failed one's when retrying the same request, else a new one
+  String _idempotencyKeyFor(String request) {
+    final key = _failedKey != null && _failedRequest == request ? _failedKey! : const Uuid().v4();
+    _failedKey = null;
+    return key;
+  }
+
+  void _rememberFailedKey(String key, String request) {
+    _failedKey = key;
+    _failedRequest = request;
+  }
+
   /// Load an existing session
   Future<void> loadSession(String sessionId) async {
     state = state.copyWith(status: ChatStatus.loading);
@@ -124,10 +143,13 @@ class ChatNotifier extends Notifier<ChatState> {
     );
 
     // Send to API
+    final request = '${state.sessionId}\u0000$message';
+    final idempotencyKey = _idempotencyKeyFor(request);
     final result = await _repository.sendMessage(
       message: message,
       sessionId: state.sessionId,
       userId: _currentUserId,
+      idempotencyKey: idempotencyKey,
     );
 
     if (result.isSuccess && result.data != null) {
@@ -145,6 +167,7 @@ class ChatNotifier extends Notifier<ChatState> {
         await _refreshSessionId();
       }
     } else {
+      _rememberFailedKey(idempotencyKey, request);
       state = state.copyWith(
         status: ChatStatus.error,
         errorMessage: result.error,
@@ -168,12 +191,15 @@ class ChatNotifier extends Notifier<ChatState> {
     );
 
     // Send to API
+    final request = '${state.sessionId}\u0000$message\u0000$fileName\u0000${imageBytes.length}';
+    final idempotencyKey = _idempotencyKeyFor(request);
     final result = await _repository.sendMessageWithImage(
       message: message.isEmpty ? 'Please analyze this image.' : message,
       imageBytes: imageBytes,
       fileName: fileName,
       sessionId: state.sessionId,
       userId: _currentUserId,
+      idempotencyKey: idempotencyKey,
     );
 
     if (result.isSuccess && result.data != null) {
@@ -187,6 +213,7 @@ class ChatNotifier extends Notifier<ChatState> {
         await _refreshSessionId();
       }
     } else {
+      _rememberFailedKey(idempotencyKey, request);
       state = state.copyWith(
         status: ChatStatus.error,
         errorMessage: result.error,